@@ -19,11 +19,190 @@ MODEL_CONFIG = {
     "num_gpu": -1,
 }
 
+# Loads the model and primes Ollama's prompt cache with the static system
+# prefixes of these prompts when the agent is built, one per parallel slot
+# stays cached so the most frequent prompt goes last
+WARMUP_CONFIG = {
+    "enabled": True,
+    "prompts": ["contextualize", "rerank", "ragqa"],
+    "num_predict": 1,
+}
+
 EMBEDDING_MODEL_CONFIG = {"model": "mxbai-embed-large"}
 
+# On-disk cache of computed embeddings, shared by ingestion and queries
+EMBEDDING_CACHE_PATH = "data/embedding_cache.db"
+EMBEDDING_CACHE_MEMORY_SIZE = 10000
+
 
 EMBEDDING_PATH = "data/processed/"
 
+# Vector store backend: "chroma" (in EMBEDDING_PATH) or "numpy", a
+# memory-mapped index with int8 / binary quantization and optional IVF.
+# Superseded numpy index versions are kept version_grace seconds for
+# readers in other processes
+VECTOR_STORE = "chroma"
+NUMPY_INDEX_CONFIG = {
+    "path": "data/processed/numpy_index/",
+    "quantization": "int8",
+    "rescore_factor": 4,
+    "ivf": True,
+    "nlist": None,
+    "nprobe": 8,
+    "ivf_min_size": 4096,
+    "version_grace": 600,
+}
+
+RAW_DATA_PATH = "data/raw/"
+
+PRODUCT_LOCATION_PATH = "data/raw/dummy_product_location.csv"
+
+DB_PATH = "databases/Main.db"
+
+# Read-only SQL: pooled connections, seconds per query, rows per result
+SQL_EXECUTOR_CONFIG = {
+    "pool_size": 4,
+    "timeout": 5.0,
+    "max_rows": 1000,
+    "page_size": 200,
+}
+
+# "hybrid" fuses BM25 and vector search with reciprocal rank fusion,
+# "similarity" is vector search only
+RETRIEVER_CONFIG = {
+    "search_type": "hybrid",
+    "k": 2,
+    "fetch_k": 8,
+    "rrf_k": 60,
+}
+
+# File path -> content hash -> chunk ids of what is in the index
+INDEX_MANIFEST_PATH = "data/processed/manifest.json"
+
+# Sync the index with RAW_DATA_PATH when the retriever is created
+INCREMENTAL_INDEXING = False
+
+# Worker processes parsing raw files, None uses every CPU
+LOADER_MAX_WORKERS = None
+
+# Ingestion: chunks per embedding request and concurrent requests to Ollama
+EMBEDDING_BATCH_SIZE = 64
+EMBEDDING_MAX_WORKERS = 4
+
+# Chunk vectors: "pooled" reuses the chunker's sentence embeddings,
+# "reembed" embeds every chunk again
+CHUNK_VECTOR_MODE = "pooled"
+
+# Ids of chunks already written by an unfinished ingestion run
+INGEST_CHECKPOINT_PATH = "data/processed/ingest_checkpoint.jsonl"
+
+# Embedding router between documents ("rag") and the store database ("db"),
+# low confidence questions are routed by the LLM
+ROUTER_CONFIG = {
+    "enabled": True,
+    "k": 5,
+    "min_confidence": 0.03,
+}
+
+# "speculative" expands the query with the LLM in parallel with retrieval
+# and merges its results if ready within deadline seconds, "off" disables it.
+# It adds one LLM call per question and up to deadline seconds of latency
+QUERY_EXPANSION_CONFIG = {
+    "mode": "off",
+    "deadline": 2.0,
+}
+
+# Relevance grading of retrieved docs: "llm", "crossencoder" or "none".
+# "crossencoder" downloads the FlashRank model (RERANKER_CONFIG) into
+# data/models/ on first use, so it needs network access once
+GRADER_TYPE = "llm"
+
+# Max number of documents graded by the LLM at the same time
+GRADER_MAX_CONCURRENCY = 8
+
+RERANKER_CONFIG = {
+    "model_name": "ms-marco-MiniLM-L-12-v2",
+    "cache_dir": "data/models/",
+    "score_threshold": 0.1,
+    "top_n": 4,
+}
+
+# Context of the RAG prompt: near duplicates (embedding cosine or word
+# shingle overlap above the thresholds) are dropped and chunks picked by
+# MMR until max_tokens approximate tokens are used
+CONTEXT_CONFIG = {
+    "max_tokens": 1500,
+    "use_embeddings": True,
+    "duplicate_threshold": 0.95,
+    "shingle_threshold": 0.7,
+    "mmr_lambda": 0.7,
+    "min_chunk_tokens": 50,
+}
+
+# Answers reused for questions whose embedding is similar enough
+SEMANTIC_CACHE_CONFIG = {
+    "enabled": True,
+    "threshold": 0.92,
+    "ttl": 24 * 60 * 60,
+    "max_size": 1000,
+}
+
+# Conversation memory per session. The history sent to rewrite follow-up
+# questions is trimmed to max_history_tokens, turns beyond
+# summarize_after_tokens are summarized in the background, keeping the
+# last keep_messages messages verbatim. Conversations idle for idle_ttl
+# seconds, or the oldest beyond max_threads, are forgotten
+MEMORY_CONFIG = {
+    "enabled": True,
+    "max_history_tokens": 1000,
+    "summarize_after_tokens": 1500,
+    "keep_messages": 4,
+    "idle_ttl": 2 * 60 * 60,
+    "max_threads": 1000,
+}
+
 DEBUG_FLAG = True
 
-LLM_CACHE_PATH = "data/cache/"
+# Spans and metrics, only recorded while DEBUG_FLAG is set. metrics_port
+# serves Prometheus text on /metrics, None only writes metrics_path
+TRACING_CONFIG = {
+    "trace_path": "data/traces/trace.jsonl",
+    "metrics_path": "data/traces/metrics.prom",
+    "metrics_port": None,
+    "max_bytes": 50 * 1024 * 1024,
+}
+
+# LLM responses cached per prompt template, expired after ttl seconds and
+# evicted least recently used above max_entries
+LLM_CACHE_PATH = "data/llm_cache.db"
+LLM_CACHE_CONFIG = {
+    "ttl": 7 * 24 * 60 * 60,
+    "max_entries": 20000,
+}
+
+# Offline benchmark (python -m src.models.benchmark): simulated seconds of
+# LLM prefill, per generated token and per embedding request
+BENCHMARK_CONFIG = {
+    "questions_path": "Questions.txt",
+    "synthetic_questions": 50,
+    "sessions": [1, 4, 8],
+    "llm_latency": 0.05,
+    "token_latency": 0.005,
+    "prompt_token_latency": 0.0002,
+    "embedding_latency": 0.01,
+    "ingest_copies": 1,
+    "grader_type": "llm",
+    "baseline_path": "data/benchmark/baseline.json",
+    "output_path": "data/benchmark/latest.json",
+    "prefill_rounds": 5,
+    "prefill_output_path": "data/benchmark/prefill.json",
+}
+
+# Offline evaluation (python -m src.models.metrics) of the golden set, judge
+# verdicts are cached so unchanged rows are not judged again
+EVALUATION_CONFIG = {
+    "golden_path": "data/eval/golden.jsonl",
+    "judge_cache_path": "data/eval/judge_cache.db",
+    "results_path": "data/eval/results.csv",
+    "max_workers": 4,
+}
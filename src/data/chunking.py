@@ -1,27 +1,151 @@
+import re
+
+import numpy as np
 from langchain.text_splitter import (
     RecursiveCharacterTextSplitter,
 )
 
-from langchain_experimental.text_splitter import SemanticChunker
-from langchain_ollama import OllamaEmbeddings
 from langchain_core.documents import Document
 
 from src import config
+from src.data.embeddings import get_embeddings
+
+
+def _normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+class SemanticChunkingEngine:
+    """Semantic chunker that embeds every sentence once and reuses it.
+
+    Sentences (with buffer_size neighbours on each side, like
+    SemanticChunker) are embedded in batches, chunks are split where the
+    cosine distance between consecutive sentences is above the given
+    percentile, and each chunk vector is the mean of its sentence vectors.
+    The vectors can go straight into the vector store, so the corpus is not
+    embedded a second time. With vector_mode="reembed" chunks are embedded
+    again instead of pooled.
+
+    # Example usage:
+    engine = SemanticChunkingEngine(get_embeddings())
+    chunks, vectors = engine.split_documents(docs)
+    generate_embeddings(chunks, vectors=vectors)
+    """
+
+    def __init__(
+        self,
+        embeddings,
+        buffer_size=1,
+        breakpoint_percentile=95,
+        min_chunk_size=300,
+        batch_size=64,
+        vector_mode="pooled",
+    ) -> None:
+        if vector_mode not in ("pooled", "reembed"):
+            raise ValueError(
+                f"Unknown vector mode '{vector_mode}', use 'pooled' or 'reembed'."
+            )
+        self.embeddings = embeddings
+        self.buffer_size = buffer_size
+        self.breakpoint_percentile = breakpoint_percentile
+        self.min_chunk_size = min_chunk_size
+        self.batch_size = batch_size
+        self.vector_mode = vector_mode
+
+    def _sentences(self, text):
+        return [s for s in re.split(r"(?<=[.?!])\s+", text) if s.strip()]
+
+    def _combine(self, sentences):
+        return [
+            " ".join(sentences[max(0, i - self.buffer_size) : i + self.buffer_size + 1])
+            for i in range(len(sentences))
+        ]
+
+    def _embed(self, texts):
+        vectors = []
+        for i in range(0, len(texts), self.batch_size):
+            vectors.extend(
+                self.embeddings.embed_documents(texts[i : i + self.batch_size])
+            )
+        return _normalize(np.asarray(vectors, dtype=np.float32))
+
+    def _breakpoints(self, vectors):
+        if len(vectors) < 2:
+            return []
+        distances = 1.0 - np.einsum("ij,ij->i", vectors[:-1], vectors[1:])
+        threshold = np.percentile(distances, self.breakpoint_percentile)
+        return np.flatnonzero(distances > threshold).tolist()
+
+    def _group(self, sentences, breakpoints):
+        """Sentence index ranges of each chunk, skipping breaks that would
+        leave a chunk shorter than min_chunk_size."""
+        groups, start = [], 0
+        for index in breakpoints:
+            end = index + 1
+            if len(" ".join(sentences[start:end])) < self.min_chunk_size:
+                continue
+            groups.append((start, end))
+            start = end
+        if start < len(sentences):
+            groups.append((start, len(sentences)))
+        return groups
+
+    def split_documents(self, docs):
+        """Return (chunks, vectors), one normalized vector per chunk."""
+        docs = [
+            Document(page_content=doc) if isinstance(doc, Document) == False else doc
+            for doc in docs
+        ]
+        doc_sentences = [self._sentences(doc.page_content) for doc in docs]
+
+        # Embed the sentences of every document in one batched pass
+        combined = [text for s in doc_sentences for text in self._combine(s)]
+        if not combined:
+            # e.g. image only PDFs or blank pages, nothing to chunk
+            return [], []
+        sentence_vectors = self._embed(combined)
+
+        chunks, vectors, offset = [], [], 0
+        for doc, sentences in zip(docs, doc_sentences):
+            if not sentences:
+                continue
+            doc_vectors = sentence_vectors[offset : offset + len(sentences)]
+            offset += len(sentences)
+            for start, end in self._group(sentences, self._breakpoints(doc_vectors)):
+                chunks.append(
+                    Document(
+                        page_content=" ".join(sentences[start:end]),
+                        metadata=dict(doc.metadata),
+                    )
+                )
+                vectors.append(doc_vectors[start:end].mean(axis=0))
+
+        if not chunks:
+            return [], []
+        if self.vector_mode == "reembed":
+            chunk_vectors = self._embed([chunk.page_content for chunk in chunks])
+        else:
+            chunk_vectors = _normalize(np.stack(vectors))
+        return chunks, chunk_vectors.tolist()
+
+
+def create_chunking_engine():
+    return SemanticChunkingEngine(
+        get_embeddings(),
+        min_chunk_size=300,
+        batch_size=config.EMBEDDING_BATCH_SIZE,
+        vector_mode=config.CHUNK_VECTOR_MODE,
+    )
 
 
 def semantic_chunker(docs):
-    docs = [
-        Document(page_content=doc) if isinstance(doc, Document) == False else doc
-        for doc in docs
-    ]
-    embeddings = OllamaEmbeddings(**config.EMBEDDING_MODEL_CONFIG)
-    text_splitter = SemanticChunker(embeddings=embeddings, min_chunk_size=300)
-
-    # Split documents into smaller chunks using text splitter
-    chunks = text_splitter.split_documents(docs)
+    # Split documents into smaller chunks using semantic breakpoints
+    chunks, _ = create_chunking_engine().split_documents(docs)
     print(f"Split {len(docs)} documents into {len(chunks)} chunks.")
 
     # Print example of page content and metadata for a chunk
-    document = chunks[0]
-    print(document.page_content)
+    if chunks:
+        print(chunks[0].page_content)
     return chunks
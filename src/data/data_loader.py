@@ -1,12 +1,14 @@
 from langchain.document_loaders import DirectoryLoader, PyMuPDFLoader
+from langchain_core.documents import Document
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import os
 
 
-from docx import Document
+import docx
 
 
 def load_word_document(filename):
-    doc = Document(filename)
+    doc = docx.Document(filename)
     full_text = []
 
     for para in doc.paragraphs:
@@ -21,21 +23,91 @@ def load_word_document(filename):
     return document_text_lower
 
 
+SUPPORTED_EXTENSIONS = (".pdf", ".docx")
+
+
+def list_data_files(folder_path):
+    """Paths of the documents under folder_path, including subfolders,
+    that the loader can parse."""
+    paths = []
+    for root, _, filenames in os.walk(folder_path):
+        paths.extend(
+            os.path.join(root, filename)
+            for filename in filenames
+            if filename.endswith(SUPPORTED_EXTENSIONS)
+        )
+    return sorted(paths)
+
+
+def _load_file_or_none(file_path):
+    try:
+        return load_file(file_path)
+    except Exception as e:
+        print(f"An error occurred while loading '{file_path}': {e}")
+        return None
+
+
+def load_file(file_path):
+    """Parse one file into documents with source and page metadata.
+
+    Module level so it can run in a worker process.
+    """
+    if file_path.endswith(".pdf"):
+        loader = PyMuPDFLoader(file_path)
+        return loader.load()
+    if file_path.endswith(".docx"):
+        text = load_word_document(file_path)
+        return [Document(page_content=text, metadata={"source": file_path, "page": 0})]
+    return []
+
+
 class DataLoader:
-    def __init__(self) -> None:
-        pass
+    """Loads PDF and DOCX files, parsing them in a pool of worker processes.
+
+    # Example usage:
+    data_loader = DataLoader(max_workers=4)
+    for doc in data_loader.iter_documents("data/raw/"):
+        print(doc.metadata["source"])
+    """
+
+    def __init__(self, max_workers=None) -> None:
+        self.max_workers = max_workers
+
+    def load_file(self, file_path):
+        return load_file(file_path)
+
+    def iter_files(self, file_paths):
+        """Yield (file_path, documents) in the order files finish parsing.
+
+        Files that fail to parse are reported and skipped.
+        """
+        file_paths = list(file_paths)
+        # A pool is not worth starting for a single file
+        if len(file_paths) <= 1 or self.max_workers == 1:
+            for file_path in file_paths:
+                docs = _load_file_or_none(file_path)
+                if docs is not None:
+                    yield file_path, docs
+            return
+
+        with ProcessPoolExecutor(max_workers=self.max_workers) as pool:
+            futures = {
+                pool.submit(_load_file_or_none, file_path): file_path
+                for file_path in file_paths
+            }
+            for future in as_completed(futures):
+                docs = future.result()
+                if docs is not None:
+                    yield futures[future], docs
+
+    def iter_documents(self, folder_path):
+        """Yield documents file by file in the order files finish parsing,
+        without waiting for the whole folder to load."""
+        for _, docs in self.iter_files(list_data_files(folder_path)):
+            yield from docs
 
     def load_data_from_folder(self, folder_path):
-        docs = []
-        for filename in os.listdir(folder_path):
-            file_path = os.path.join(folder_path, filename)
-            if filename.endswith(".pdf"):
-                loader = PyMuPDFLoader(file_path)
-                docs.extend(loader.load())
-            elif filename.endswith(".docx"):
-                doc = load_word_document(file_path)
-                docs.append(doc)
-        return docs
+        return list(self.iter_documents(folder_path))
 
 
 if __name__ == "__main__":
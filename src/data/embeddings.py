@@ -1,22 +1,361 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
 from langchain_ollama import OllamaEmbeddings
 from langchain_community.vectorstores import InMemoryVectorStore
-from langchain_chroma import Chroma
 from src import config
+from src.helper.tracing import record_cache, span
+from src.data.vector_store import NumpyVectorStore, create_vector_store
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper that never embeds the same text twice.
+
+    Vectors are keyed by (model name, text hash) and kept in an in-memory
+    LRU in front of an on-disk SQLite store, so re-running ingestion or
+    repeating a query reuses the stored vector.
+
+    # Example usage:
+    embeddings = CachedEmbeddings(
+        OllamaEmbeddings(model="mxbai-embed-large"),
+        model_name="mxbai-embed-large",
+        cache_path="data/embedding_cache.db",
+    )
+    vectors = embeddings.embed_documents(["what is backfill process?"])
+    """
+
+    def __init__(self, embeddings, model_name, cache_path, memory_size=10000):
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.cache_path = cache_path
+        self.memory_size = memory_size
+
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+
+        cache_dir = os.path.dirname(cache_path)
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+        self._conn = sqlite3.connect(cache_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL;")
+        self._conn.execute("PRAGMA synchronous=NORMAL;")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB)"
+        )
+        self._conn.commit()
+
+    def _key(self, text):
+        digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        return f"{self.model_name}:{digest}"
+
+    def _get(self, keys):
+        """Return the cached vectors for keys, from memory first then disk."""
+        found = {}
+        with self._lock:
+            for key in keys:
+                vector = self._memory.get(key)
+                if vector is not None:
+                    self._memory.move_to_end(key)
+                    found[key] = vector
+
+            missing = [key for key in keys if key not in found]
+            # Stay below SQLite's limit of host parameters per statement
+            for i in range(0, len(missing), 500):
+                batch = missing[i : i + 500]
+                rows = self._conn.execute(
+                    "SELECT key, vector FROM embeddings WHERE key IN "
+                    f"({','.join('?' * len(batch))})",
+                    batch,
+                ).fetchall()
+                for key, blob in rows:
+                    vector = np.frombuffer(blob, dtype=np.float32)
+                    found[key] = vector
+                    self._remember(key, vector)
+        return found
+
+    def _put(self, items):
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                [(key, vector.tobytes()) for key, vector in items],
+            )
+            self._conn.commit()
+            for key, vector in items:
+                self._remember(key, vector)
+
+    def _remember(self, key, vector):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+
+    def embed_documents(self, texts):
+        keys = [self._key(text) for text in texts]
+        found = self._get(list(dict.fromkeys(keys)))
+
+        to_embed = {}
+        for key, text in zip(keys, texts):
+            if key not in found:
+                to_embed.setdefault(key, text)
+
+        record_cache("embedding", len(keys) - len(to_embed), len(to_embed))
+        if to_embed:
+            with span("embedding", self.model_name, texts=len(to_embed)):
+                vectors = self.embeddings.embed_documents(list(to_embed.values()))
+            items = [
+                (key, np.asarray(vector, dtype=np.float32))
+                for key, vector in zip(to_embed, vectors)
+            ]
+            self._put(items)
+            found.update(items)
+
+        return [found[key].tolist() for key in keys]
+
+    def embed_query(self, text):
+        key = self._key(text)
+        found = self._get([key])
+        record_cache("embedding", int(key in found), int(key not in found))
+        if key not in found:
+            with span("embedding", self.model_name, texts=1):
+                vector = self.embeddings.embed_query(text)
+            vector = np.asarray(vector, dtype=np.float32)
+            self._put([(key, vector)])
+            found[key] = vector
+        return found[key].tolist()
+
+
+_shared_embeddings = {}
+_shared_lock = threading.Lock()
+
+
+def get_embeddings(model_config=None):
+    """Return the process-wide cached embeddings for the model config.
+
+    Every place that embeds text should use this so chunking, indexing and
+    querying share one cache.
+    """
+    model_config = model_config or config.EMBEDDING_MODEL_CONFIG
+    key = repr(sorted(model_config.items()))
+    with _shared_lock:
+        if key not in _shared_embeddings:
+            _shared_embeddings[key] = CachedEmbeddings(
+                OllamaEmbeddings(**model_config),
+                model_name=model_config["model"],
+                cache_path=config.EMBEDDING_CACHE_PATH,
+                memory_size=config.EMBEDDING_CACHE_MEMORY_SIZE,
+            )
+        return _shared_embeddings[key]
+
+
+class EmbeddingWriter:
+    """Embeds documents in batches and upserts each batch into the vector store.
+
+    At most max_workers embedding requests run at the same time and only a
+    bounded number of batches are held in memory. Ids of written chunks are
+    appended to a checkpoint file, so a crashed run picks up where it
+    stopped when called again with the same ids. Precomputed vectors (e.g.
+    from the chunking engine) are upserted without embedding again.
 
+    Documents can be written in several calls with finish=False, e.g. one
+    per file as files are parsed, followed by finish().
 
-def generate_embeddings(docs):
+    # Example usage:
+    writer = EmbeddingWriter(db, get_embeddings(), batch_size=64, max_workers=4)
+    stats = writer.write(docs, ids)
+    print(stats["chunks_per_sec"])
+    """
+
+    def __init__(
+        self, db, embeddings, batch_size=64, max_workers=4, checkpoint_path=None
+    ):
+        self.db = db
+        self.embeddings = embeddings
+        self.batch_size = batch_size
+        self.max_workers = max_workers
+        self.checkpoint_path = checkpoint_path
+
+        # Written but not yet flushed, carried over between write calls
+        self._unflushed = []
+        self._batches_since_flush = 0
+
+    def _load_checkpoint(self):
+        if not self.checkpoint_path or not os.path.exists(self.checkpoint_path):
+            return set()
+        with open(self.checkpoint_path) as f:
+            return {chunk_id for line in f for chunk_id in json.loads(line)}
+
+    def _save_checkpoint(self, ids):
+        if not self.checkpoint_path:
+            return
+        with open(self.checkpoint_path, "a") as f:
+            f.write(json.dumps(ids) + "\n")
+
+    def _clear_checkpoint(self):
+        clear_checkpoint(self.checkpoint_path)
+
+    def _stored(self, ids):
+        """Those of ids that are in the vector store."""
+        if not ids:
+            return set()
+        return set(self.db.get(ids=list(ids), include=[])["ids"])
+
+    def _embed_batch(self, batch):
+        if all(vector is not None for _, _, vector in batch):
+            return [vector for _, _, vector in batch]
+        return self.embeddings.embed_documents(
+            [doc.page_content for _, doc, _ in batch]
+        )
+
+    def _upsert_batch(self, batch, vectors):
+        if isinstance(self.db, NumpyVectorStore):
+            # Persisted once by finish(), every persist rewrites the whole index
+            self.db.upsert(
+                ids=[chunk_id for chunk_id, _, _ in batch],
+                embeddings=vectors,
+                documents=[doc.page_content for _, doc, _ in batch],
+                metadatas=[doc.metadata for _, doc, _ in batch],
+                persist=False,
+            )
+            return
+        self.db._collection.upsert(
+            ids=[chunk_id for chunk_id, _, _ in batch],
+            embeddings=vectors,
+            documents=[doc.page_content for _, doc, _ in batch],
+            # Chroma rejects empty metadata dicts
+            metadatas=[doc.metadata or None for _, doc, _ in batch],
+        )
+
+    def _flush(self, chunk_ids):
+        """Make written chunks durable, then record them in the checkpoint."""
+        if isinstance(self.db, NumpyVectorStore):
+            self.db.persist()
+        self._save_checkpoint(chunk_ids)
+
+    def write(self, docs, ids, vectors=None, finish=True):
+        """Embed and upsert docs, returns chunk counts and throughput.
+
+        With finish=False the checkpoint is kept and the last batches may not
+        be flushed yet, call finish() after the last write.
+        """
+        start = time.perf_counter()
+        # Checkpointed chunks are only skipped while they are still stored,
+        # e.g. not after the collection was reset since the crashed run
+        done = self._stored(self._load_checkpoint() & set(ids))
+        vectors = vectors if vectors is not None else [None] * len(docs)
+        pending = [
+            (chunk_id, doc, vector)
+            for chunk_id, doc, vector in zip(ids, docs, vectors)
+            if chunk_id not in done
+        ]
+        batches = [
+            pending[i : i + self.batch_size]
+            for i in range(0, len(pending), self.batch_size)
+        ]
+        if done:
+            print(
+                f"Resuming ingestion, {len(docs) - len(pending)} chunks already written."
+            )
+
+        # Chroma writes each batch durably. The NumPy store is only persisted
+        # once by finish(), each persist rebuilds the codes and IVF lists and
+        # rewrites the index, a crashed run re-embeds from the embedding cache
+        flush_every = None if isinstance(self.db, NumpyVectorStore) else 1
+        written = 0
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            in_flight = {}
+            next_batch = 0
+            while next_batch < len(batches) or in_flight:
+                # Keep a bounded window of batches in flight
+                while (
+                    next_batch < len(batches) and len(in_flight) < 2 * self.max_workers
+                ):
+                    batch = batches[next_batch]
+                    in_flight[pool.submit(self._embed_batch, batch)] = batch
+                    next_batch += 1
+
+                finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    batch = in_flight.pop(future)
+                    self._upsert_batch(batch, future.result())
+                    self._unflushed.extend(chunk_id for chunk_id, _, _ in batch)
+                    written += len(batch)
+                    self._batches_since_flush += 1
+                    if flush_every and self._batches_since_flush >= flush_every:
+                        self._flush(self._unflushed)
+                        self._unflushed, self._batches_since_flush = [], 0
+        if finish:
+            self.finish()
+
+        elapsed = time.perf_counter() - start
+        stats = {
+            "chunks": len(docs),
+            "written": written,
+            "skipped": len(docs) - len(pending),
+            "seconds": elapsed,
+            "chunks_per_sec": written / elapsed if elapsed else 0.0,
+        }
+        print(
+            f"Embedded {written} chunks in {elapsed:.2f}s "
+            f"({stats['chunks_per_sec']:.1f} chunks/sec)."
+        )
+        return stats
+
+    def finish(self):
+        """Flush the remaining chunks and forget the checkpoint."""
+        if self._unflushed:
+            self._flush(self._unflushed)
+        self._unflushed, self._batches_since_flush = [], 0
+        self._clear_checkpoint()
+
+
+def clear_checkpoint(path=None):
+    """Forget an unfinished ingestion run, call this when the collection is
+    reset so its chunks are written again."""
+    path = path or config.INGEST_CHECKPOINT_PATH
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def _content_ids(docs):
+    return [
+        hashlib.sha256(
+            (doc.page_content + json.dumps(doc.metadata, sort_keys=True)).encode()
+        ).hexdigest()[:32]
+        for doc in docs
+    ]
+
+
+def create_embedding_writer(db, embeddings=None):
+    """EmbeddingWriter for db with the configured batching and checkpoint."""
+    return EmbeddingWriter(
+        db,
+        embeddings or get_embeddings(),
+        batch_size=config.EMBEDDING_BATCH_SIZE,
+        max_workers=config.EMBEDDING_MAX_WORKERS,
+        checkpoint_path=config.INGEST_CHECKPOINT_PATH,
+    )
+
+
+def generate_embeddings(docs, ids=None, vectors=None):
 
     print("Starting to generate embeddings...")
 
-    embeddings = OllamaEmbeddings(**config.EMBEDDING_MODEL_CONFIG)
+    embeddings = get_embeddings()
     print("Embeddings model initialized.")
 
-    # Create Emdeddings
-    db = Chroma.from_documents(
-        documents=docs, embedding=embeddings, persist_directory=config.EMBEDDING_PATH
-    )
-    # Load Embeddings
-    db = Chroma(embedding_function=embeddings, persist_directory=config.EMBEDDING_PATH)
+    db = create_vector_store(embeddings)
+
+    # Create Emdeddings, ids default to the content so a resumed run matches
+    writer = create_embedding_writer(db, embeddings)
+    writer.write(docs, ids or _content_ids(docs), vectors=vectors)
     print("Database created from documents.")
 
     # print(db.similarity_search("holidays 2025"))
@@ -0,0 +1,533 @@
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from typing import Any, Iterable, List, Optional, Tuple
+
+import numpy as np
+from langchain_chroma import Chroma
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStore
+
+from src import config
+
+QUANTIZATIONS = ("float32", "int8", "binary")
+
+# Number of set bits of every byte value, for hamming distances of packed codes
+_POPCOUNT = (
+    np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1)
+    .sum(axis=1)
+    .astype(np.int32)
+)
+
+
+def _normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def _top_k(scores, k):
+    """Indices of the k highest scores, best first."""
+    if k >= len(scores):
+        return np.argsort(scores)[::-1]
+    top = np.argpartition(scores, -k)[-k:]
+    return top[np.argsort(scores[top])[::-1]]
+
+
+def quantize_int8(vectors):
+    """Symmetric per-row int8 codes and the scale to restore them."""
+    scales = np.abs(vectors).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    codes = np.round(vectors / scales[:, None]).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+
+def quantize_binary(vectors):
+    """One sign bit per dimension, packed 8 per byte."""
+    return np.packbits(vectors > 0, axis=1)
+
+
+def train_ivf(vectors, nlist, iterations=10, seed=0):
+    """Spherical k-means, returns (centroids, row order, list offsets).
+
+    Rows of list i are order[offsets[i]:offsets[i + 1]].
+    """
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), size=nlist, replace=False)]
+    for _ in range(iterations):
+        assignments = np.argmax(vectors @ centroids.T, axis=1)
+        for i in range(nlist):
+            members = vectors[assignments == i]
+            if len(members):
+                centroids[i] = members.mean(axis=0)
+        centroids = _normalize(centroids)
+    assignments = np.argmax(vectors @ centroids.T, axis=1)
+    order = np.argsort(assignments, kind="stable")
+    offsets = np.searchsorted(assignments[order], np.arange(nlist + 1))
+    return centroids.astype(np.float32), order, offsets
+
+
+class NumpyVectorStore(VectorStore):
+    """Exact or IVF vector search over memory-mapped NumPy arrays.
+
+    Vectors are normalized float32, searched with one matmul. With int8 or
+    binary quantization the compact codes are scanned first and the best
+    rescore_factor * k rows are rescored with their float vectors. An IVF
+    index (spherical k-means) limits the scan to the nprobe closest lists
+    once the store holds ivf_min_size vectors.
+
+    The index is a directory of .npy files plus a meta.json sidecar with
+    ids, texts and metadata. Arrays are opened with mmap_mode="r", so
+    loading takes milliseconds and only the rows that are searched are
+    read from disk. Every persist writes the index into a new version
+    directory and swaps manifest.json, which suits corpora that fit in RAM.
+    The previous version is kept, older ones are deleted once they were
+    superseded version_grace seconds ago, so readers in other processes
+    that just read the old manifest can still open its arrays.
+
+    # Example usage:
+    db = NumpyVectorStore(get_embeddings(), path="data/processed/numpy_index/")
+    db.upsert(ids, embeddings=vectors, documents=texts, metadatas=metadatas)
+    retriever = db.as_retriever(search_kwargs={"k": 2})
+    """
+
+    def __init__(
+        self,
+        embedding,
+        path=None,
+        quantization="int8",
+        rescore_factor=4,
+        ivf=True,
+        nlist=None,
+        nprobe=8,
+        ivf_min_size=4096,
+        version_grace=600,
+    ) -> None:
+        if quantization not in QUANTIZATIONS:
+            raise ValueError(
+                f"Unknown quantization '{quantization}', use one of {QUANTIZATIONS}."
+            )
+        self._embedding = embedding
+        self.path = path
+        self.quantization = quantization
+        self.rescore_factor = rescore_factor
+        self.ivf = ivf
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.ivf_min_size = ivf_min_size
+        self.version_grace = version_grace
+
+        self._lock = threading.RLock()
+        self._clear()
+        if path and os.path.exists(os.path.join(path, "manifest.json")):
+            self._load()
+
+    @property
+    def embeddings(self):
+        return self._embedding
+
+    def __len__(self):
+        return len(self._ids)
+
+    def _clear(self):
+        self._ids, self._texts, self._metadatas = [], [], []
+        self._positions = {}
+        # Rows appended by upsert, _vectors is a view of its first len(self) rows
+        self._buffer = None
+        self._vectors = None
+        self._codes = self._scales = None
+        self._centroids = self._order = self._offsets = None
+        # Codes and IVF lists are rebuilt lazily after writes
+        self._stale = False
+
+    # Persistence
+
+    def _load(self):
+        with open(os.path.join(self.path, "manifest.json")) as f:
+            manifest = json.load(f)
+        directory = os.path.join(self.path, manifest["version"])
+        with open(os.path.join(directory, "meta.json")) as f:
+            meta = json.load(f)
+
+        def array(name):
+            file_path = os.path.join(directory, f"{name}.npy")
+            if not os.path.exists(file_path):
+                return None
+            return np.load(file_path, mmap_mode="r")
+
+        self._ids, self._texts = meta["ids"], meta["documents"]
+        self._metadatas = meta["metadatas"]
+        self._positions = {doc_id: i for i, doc_id in enumerate(self._ids)}
+        self._vectors = array("vectors")
+        if manifest["settings"] == self._settings():
+            self._codes, self._scales = array("codes"), array("scales")
+            self._centroids = array("ivf_centroids")
+            self._order, self._offsets = array("ivf_order"), array("ivf_offsets")
+        else:
+            # Stored with other settings, rebuild the codes in memory
+            self._stale = True
+
+    def _settings(self):
+        """Settings the stored codes and IVF lists were built with."""
+        return {
+            "quantization": self.quantization,
+            "ivf": self.ivf,
+            "nlist": self.nlist,
+            "ivf_min_size": self.ivf_min_size,
+        }
+
+    def _build_index(self):
+        """Quantized codes and IVF lists for the current float vectors."""
+        self._stale = False
+        self._codes = self._scales = None
+        self._centroids = self._order = self._offsets = None
+        if self._vectors is None or not len(self._vectors):
+            return
+        vectors = np.asarray(self._vectors, dtype=np.float32)
+        if self.quantization == "int8":
+            self._codes, self._scales = quantize_int8(vectors)
+        elif self.quantization == "binary":
+            self._codes = quantize_binary(vectors)
+        if self.ivf and len(vectors) >= self.ivf_min_size:
+            nlist = self.nlist or int(np.sqrt(len(vectors)))
+            self._centroids, self._order, self._offsets = train_ivf(vectors, nlist)
+
+    def persist(self):
+        """Write the index to a new version directory and switch to it."""
+        if not self.path:
+            return
+        with self._lock:
+            if self._stale:
+                self._build_index()
+            self._write_version()
+
+    def _write_version(self):
+        os.makedirs(self.path, exist_ok=True)
+        version = f"v-{uuid.uuid4().hex[:12]}"
+        directory = os.path.join(self.path, version)
+        os.makedirs(directory)
+
+        arrays = {
+            "vectors": self._vectors,
+            "codes": self._codes,
+            "scales": self._scales,
+            "ivf_centroids": self._centroids,
+            "ivf_order": self._order,
+            "ivf_offsets": self._offsets,
+        }
+        for name, values in arrays.items():
+            if values is not None:
+                np.save(os.path.join(directory, f"{name}.npy"), values)
+        with open(os.path.join(directory, "meta.json"), "w") as f:
+            json.dump(
+                {
+                    "ids": self._ids,
+                    "documents": self._texts,
+                    "metadatas": self._metadatas,
+                },
+                f,
+            )
+
+        manifest_path = os.path.join(self.path, "manifest.json")
+        previous = None
+        if os.path.exists(manifest_path):
+            with open(manifest_path) as f:
+                previous = json.load(f)["version"]
+        tmp_path = f"{manifest_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(
+                {
+                    "version": version,
+                    "settings": self._settings(),
+                    "count": len(self._ids),
+                },
+                f,
+            )
+        os.replace(tmp_path, manifest_path)
+        self._remove_old_versions(version, previous)
+
+    def _remove_old_versions(self, version, previous):
+        """Delete versions superseded more than version_grace seconds ago.
+
+        A version directory's mtime is set when it is superseded, readers
+        that read the manifest before that have had the grace period to
+        open its arrays. Open memory maps stay valid after deletion.
+        """
+        now = time.time()
+        if previous:
+            try:
+                os.utime(os.path.join(self.path, previous), (now, now))
+            except OSError:
+                pass
+        for name in os.listdir(self.path):
+            if not name.startswith("v-") or name in (version, previous):
+                continue
+            directory = os.path.join(self.path, name)
+            try:
+                superseded = os.path.getmtime(directory)
+            except OSError:
+                continue
+            if now - superseded >= self.version_grace:
+                shutil.rmtree(directory, ignore_errors=True)
+
+    # Writes
+
+    def _reserve(self, rows, dim):
+        """Make room for rows vectors, doubling the buffer so a series of
+        upserts copies every row only a constant number of times."""
+        if self._buffer is not None and len(self._buffer) >= rows:
+            return
+        capacity = max(rows, 2 * (0 if self._vectors is None else len(self._vectors)))
+        buffer = np.empty((capacity, dim), dtype=np.float32)
+        if self._vectors is not None:
+            buffer[: len(self._vectors)] = self._vectors
+        self._buffer = buffer
+        self._vectors = buffer[: len(self._ids)]
+
+    def upsert(self, ids, embeddings, documents, metadatas=None, persist=True):
+        """Insert or replace rows by id. With persist=False the caller is
+        expected to call persist() once a group of writes is done, codes and
+        IVF lists are then only built once."""
+        metadatas = metadatas or [None] * len(ids)
+        vectors = _normalize(np.asarray(embeddings, dtype=np.float32))
+        # The last row wins when an id is given more than once
+        latest = {doc_id: i for i, doc_id in enumerate(ids)}
+        with self._lock:
+            n_new = sum(doc_id not in self._positions for doc_id in latest)
+            self._reserve(len(self._ids) + n_new, vectors.shape[1])
+            for doc_id, i in latest.items():
+                position = self._positions.get(doc_id)
+                if position is None:
+                    position = self._positions[doc_id] = len(self._ids)
+                    self._ids.append(doc_id)
+                    self._texts.append(documents[i])
+                    self._metadatas.append(metadatas[i] or {})
+                else:
+                    self._texts[position] = documents[i]
+                    self._metadatas[position] = metadatas[i] or {}
+                self._buffer[position] = vectors[i]
+            self._vectors = self._buffer[: len(self._ids)]
+            self._stale = True
+            if persist:
+                self.persist()
+
+    def add_texts(
+        self,
+        texts: Iterable[str],
+        metadatas: Optional[List[dict]] = None,
+        *,
+        ids: Optional[List[str]] = None,
+        **kwargs: Any,
+    ) -> List[str]:
+        texts = list(texts)
+        ids = list(ids) if ids else [str(uuid.uuid4()) for _ in texts]
+        self.upsert(
+            ids, self._embedding.embed_documents(texts), texts, metadatas=metadatas
+        )
+        return ids
+
+    def delete(self, ids: Optional[List[str]] = None, **kwargs: Any) -> bool:
+        with self._lock:
+            remove = {
+                self._positions[doc_id]
+                for doc_id in ids or []
+                if doc_id in self._positions
+            }
+            if not remove:
+                return True
+            keep = [i for i in range(len(self._ids)) if i not in remove]
+            self._ids = [self._ids[i] for i in keep]
+            self._texts = [self._texts[i] for i in keep]
+            self._metadatas = [self._metadatas[i] for i in keep]
+            self._positions = {doc_id: i for i, doc_id in enumerate(self._ids)}
+            self._vectors = np.array(self._vectors[keep], dtype=np.float32)
+            self._buffer = None
+            self._stale = True
+            self.persist()
+        return True
+
+    def reset_collection(self):
+        with self._lock:
+            self._clear()
+            self.persist()
+
+    # Reads
+
+    def get(self, ids=None, include=None):
+        """Stored rows in the same shape as Chroma.get."""
+        with self._lock:
+            positions = (
+                range(len(self._ids))
+                if ids is None
+                else [self._positions[i] for i in ids if i in self._positions]
+            )
+            data = {
+                "ids": [self._ids[i] for i in positions],
+                "documents": [self._texts[i] for i in positions],
+                "metadatas": [self._metadatas[i] for i in positions],
+            }
+            if include and "embeddings" in include:
+                data["embeddings"] = np.array(
+                    self._vectors[list(positions)], dtype=np.float32
+                )
+            return data
+
+    def get_by_ids(self, ids):
+        data = self.get(ids=ids)
+        return [
+            Document(id=doc_id, page_content=text, metadata=dict(metadata))
+            for doc_id, text, metadata in zip(
+                data["ids"], data["documents"], data["metadatas"]
+            )
+        ]
+
+    def _candidates(self, query):
+        """Rows in the nprobe IVF lists closest to the query, None for all."""
+        if self._centroids is None:
+            return None
+        nprobe = min(self.nprobe, len(self._centroids))
+        lists = _top_k(self._centroids @ query, nprobe)
+        return np.concatenate(
+            [self._order[self._offsets[i] : self._offsets[i + 1]] for i in lists]
+        )
+
+    def _allowed(self, filter):
+        return np.array(
+            [
+                i
+                for i, metadata in enumerate(self._metadatas)
+                if all(metadata.get(key) == value for key, value in filter.items())
+            ],
+            dtype=np.int64,
+        )
+
+    def _search(self, query, k, filter=None):
+        """Return [(row, cosine similarity)] of the k best rows."""
+        query = _normalize(np.asarray(query, dtype=np.float32))
+        with self._lock:
+            if not self._ids:
+                return []
+            if self._stale:
+                self._build_index()
+            vectors, codes, scales = self._vectors, self._codes, self._scales
+            rows = self._candidates(query)
+            if filter:
+                allowed = self._allowed(filter)
+                rows = allowed if rows is None else np.intersect1d(rows, allowed)
+            if rows is not None and not len(rows):
+                return []
+
+        def subset(values):
+            return values if rows is None else values[rows]
+
+        if self.quantization == "float32" or codes is None:
+            scores = np.asarray(subset(vectors)) @ query
+            top = _top_k(scores, k)
+            top_rows = top if rows is None else rows[top]
+            return [(int(row), float(scores[i])) for row, i in zip(top_rows, top)]
+
+        if self.quantization == "int8":
+            approximate = (subset(codes) @ query) * subset(scales)
+        else:
+            query_code = quantize_binary(query[None, :])[0]
+            approximate = -_POPCOUNT[subset(codes) ^ query_code].sum(axis=1)
+        shortlist = _top_k(approximate, k * self.rescore_factor)
+        shortlist_rows = shortlist if rows is None else rows[shortlist]
+
+        # Rescore the shortlist with the float vectors, reading the memory
+        # map in row order
+        order = np.argsort(shortlist_rows)
+        exact = np.empty(len(shortlist), dtype=np.float32)
+        exact[order] = np.asarray(vectors[shortlist_rows[order]]) @ query
+        return [(int(shortlist_rows[i]), float(exact[i])) for i in _top_k(exact, k)]
+
+    def self_recall(self, sample=100, k=10, seed=0):
+        """Fraction of sampled stored vectors that are in the top k when
+        searched for, a quick check of the quantized and IVF search."""
+        with self._lock:
+            rng = np.random.default_rng(seed)
+            n = len(self._ids)
+            rows = rng.choice(n, size=min(sample, n), replace=False)
+            queries = [np.array(self._vectors[row]) for row in rows]
+        if not len(rows):
+            return 1.0
+        hits = sum(
+            any(found == row for found, _ in self._search(query, k))
+            for row, query in zip(rows, queries)
+        )
+        return hits / len(rows)
+
+    def _document(self, row):
+        return Document(
+            id=self._ids[row],
+            page_content=self._texts[row],
+            metadata=dict(self._metadatas[row]),
+        )
+
+    def similarity_search_with_score_by_vector(self, embedding, k=4, filter=None):
+        return [
+            (self._document(row), score)
+            for row, score in self._search(embedding, k, filter)
+        ]
+
+    def similarity_search_with_score(
+        self, query: str, k: int = 4, filter=None, **kwargs: Any
+    ) -> List[Tuple[Document, float]]:
+        embedding = self._embedding.embed_query(query)
+        return self.similarity_search_with_score_by_vector(embedding, k, filter)
+
+    def similarity_search_by_vector(
+        self, embedding: List[float], k: int = 4, filter=None, **kwargs: Any
+    ) -> List[Document]:
+        return [
+            doc
+            for doc, _ in self.similarity_search_with_score_by_vector(
+                embedding, k, filter
+            )
+        ]
+
+    def similarity_search(
+        self, query: str, k: int = 4, filter=None, **kwargs: Any
+    ) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, filter)]
+
+    def _select_relevance_score_fn(self):
+        # Cosine similarity in [-1, 1] to a relevance score in [0, 1]
+        return lambda score: (score + 1.0) / 2.0
+
+    @classmethod
+    def from_texts(
+        cls,
+        texts: List[str],
+        embedding,
+        metadatas: Optional[List[dict]] = None,
+        *,
+        ids: Optional[List[str]] = None,
+        **kwargs: Any,
+    ) -> "NumpyVectorStore":
+        store = cls(embedding, **kwargs)
+        store.add_texts(texts, metadatas=metadatas, ids=ids)
+        return store
+
+
+def create_vector_store(embeddings):
+    """Persistent vector store of the configured backend (config.VECTOR_STORE)."""
+    if config.VECTOR_STORE == "numpy":
+        return NumpyVectorStore(embeddings, **config.NUMPY_INDEX_CONFIG)
+    if config.VECTOR_STORE != "chroma":
+        raise ValueError(
+            f"Unknown vector store '{config.VECTOR_STORE}', use 'chroma' or 'numpy'."
+        )
+    return Chroma(
+        embedding_function=embeddings, persist_directory=config.EMBEDDING_PATH
+    )
+
+
+def vector_store_file():
+    """File that changes whenever the configured vector store is written."""
+    if config.VECTOR_STORE == "numpy":
+        return os.path.join(config.NUMPY_INDEX_CONFIG["path"], "manifest.json")
+    return os.path.join(config.EMBEDDING_PATH, "chroma.sqlite3")
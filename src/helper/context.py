@@ -0,0 +1,213 @@
+import re
+
+import numpy as np
+from langchain_core.documents import Document
+
+from src import config
+from src.helper.tracing import increment
+from src.helper.utlis import format_docs
+
+# Letter runs of up to 7 characters, digit runs of up to 3 and single
+# punctuation marks, close to how Llama style BPE vocabularies split text
+_TOKEN_PATTERN = re.compile(r"[^\W\d_]{1,7}|\d{1,3}|[^\w\s]|_")
+
+_WORD_PATTERN = re.compile(r"\w+")
+
+
+def count_tokens(text):
+    """Approximate number of LLM tokens in text, without loading a tokenizer."""
+    return len(_TOKEN_PATTERN.findall(text))
+
+
+def truncate_tokens(text, max_tokens):
+    """Cut text after max_tokens approximate tokens."""
+    if max_tokens <= 0:
+        return ""
+    for i, match in enumerate(_TOKEN_PATTERN.finditer(text)):
+        if i == max_tokens:
+            return text[: match.start()].rstrip()
+    return text
+
+
+def shingles(text, size=3):
+    """Set of word n-grams of text, used to spot overlapping chunks."""
+    words = _WORD_PATTERN.findall(text.lower())
+    if len(words) <= size:
+        return {tuple(words)} if words else set()
+    return {tuple(words[i : i + size]) for i in range(len(words) - size + 1)}
+
+
+def _jaccard(a, b):
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+class ContextPacker:
+    """Builds the RAG prompt context from the graded documents.
+
+    Near-duplicate chunks (shingle Jaccard or embedding cosine above the
+    thresholds) are dropped, the rest are picked by maximal marginal
+    relevance until max_tokens is used up, the last one truncated if at
+    least min_chunk_tokens still fit. The picked chunks are ordered by
+    relevance to the question.
+
+    Relevance is the reranker's relevance_score when every chunk has one,
+    otherwise the cosine to the question when embeddings are given and the
+    order of the documents as retrieved without them. Chunk vectors are
+    read from vector_store, only chunks it doesn't have are embedded.
+
+    # Example usage:
+    packer = ContextPacker(get_embeddings(), vector_store=db, max_tokens=1500)
+    documents, stats = packer.pack("how to do backfill?", documents)
+    context = format_docs(documents)
+    """
+
+    def __init__(
+        self,
+        embeddings=None,
+        vector_store=None,
+        max_tokens=1500,
+        duplicate_threshold=0.95,
+        shingle_threshold=0.7,
+        mmr_lambda=0.7,
+        min_chunk_tokens=50,
+    ) -> None:
+        self.embeddings = embeddings
+        self.vector_store = vector_store
+        self.max_tokens = max_tokens
+        self.duplicate_threshold = duplicate_threshold
+        self.shingle_threshold = shingle_threshold
+        self.mmr_lambda = mmr_lambda
+        self.min_chunk_tokens = min_chunk_tokens
+
+    def _chunk_vectors(self, documents):
+        """Stored vectors of the documents, embedding those not in the store."""
+        stored = {}
+        ids = [doc.id for doc in documents if doc.id]
+        if self.vector_store is not None and ids:
+            data = self.vector_store.get(ids=ids, include=["embeddings"])
+            stored = dict(zip(data["ids"], data["embeddings"]))
+        vectors = [stored.get(doc.id) for doc in documents]
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            embedded = self.embeddings.embed_documents(
+                [documents[i].page_content for i in missing]
+            )
+            for i, vector in zip(missing, embedded):
+                vectors[i] = vector
+        return np.asarray(vectors, dtype=np.float32)
+
+    def _similarities(self, question, documents):
+        """Return (cosine to the question, document similarity matrix)."""
+        vectors = self._chunk_vectors(documents)
+        # The retriever just embedded the question, this is a cache hit
+        query = np.asarray(self.embeddings.embed_query(question), dtype=np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True) + 1e-12
+        query /= np.linalg.norm(query) + 1e-12
+        return vectors @ query, vectors @ vectors.T
+
+    def pack(self, question, documents):
+        """Return (packed documents, stats) for the question."""
+        documents = list(documents)
+        token_counts = [count_tokens(doc.page_content) for doc in documents]
+        stats = {
+            "input_chunks": len(documents),
+            "input_tokens": sum(token_counts),
+            "duplicates": 0,
+            "truncated": 0,
+        }
+        if not documents:
+            return [], {**stats, "kept_chunks": 0, "tokens": 0, "tokens_saved": 0}
+
+        n = len(documents)
+        relevance = 1.0 - np.arange(n, dtype=np.float32) / n
+        similarity = np.zeros((n, n), dtype=np.float32)
+        if self.embeddings is not None:
+            try:
+                relevance, similarity = self._similarities(question, documents)
+            except Exception as e:
+                print(f"Embedding the context failed, packing without it: {e}")
+        scores = [doc.metadata.get("relevance_score") for doc in documents]
+        if all(score is not None for score in scores):
+            # The cross-encoder judged the question and chunk together
+            relevance = np.asarray(scores, dtype=np.float32)
+
+        doc_shingles = [shingles(doc.page_content) for doc in documents]
+        overlap = np.zeros((n, n), dtype=np.float32)
+        for i in range(n):
+            for j in range(i + 1, n):
+                overlap[i, j] = overlap[j, i] = _jaccard(
+                    doc_shingles[i], doc_shingles[j]
+                )
+        redundancy = np.maximum(similarity, overlap)
+
+        # Of each group of near duplicates keep the most relevant chunk
+        candidates = []
+        for i in np.argsort(-relevance, kind="stable"):
+            duplicate = any(
+                similarity[i, j] >= self.duplicate_threshold
+                or overlap[i, j] >= self.shingle_threshold
+                for j in candidates
+            )
+            if duplicate:
+                stats["duplicates"] += 1
+            else:
+                candidates.append(int(i))
+
+        picked, budget = [], self.max_tokens
+        while candidates and budget > 0:
+            # Maximal marginal relevance against the chunks picked so far
+            penalty = [
+                max((redundancy[i, j] for j, _ in picked), default=0.0)
+                for i in candidates
+            ]
+            scores = [
+                self.mmr_lambda * relevance[i] - (1 - self.mmr_lambda) * p
+                for i, p in zip(candidates, penalty)
+            ]
+            best = candidates[int(np.argmax(scores))]
+            candidates.remove(best)
+            doc = documents[best]
+            if token_counts[best] > budget:
+                if budget < self.min_chunk_tokens:
+                    continue
+                doc = Document(
+                    page_content=truncate_tokens(doc.page_content, budget),
+                    metadata=doc.metadata,
+                    id=doc.id,
+                )
+                stats["truncated"] += 1
+            picked.append((best, doc))
+            budget -= count_tokens(doc.page_content)
+
+        picked.sort(key=lambda item: -relevance[item[0]])
+        packed = [doc for _, doc in picked]
+        tokens = count_tokens(format_docs(packed))
+        stats.update(
+            kept_chunks=len(packed),
+            tokens=tokens,
+            tokens_saved=max(0, stats["input_tokens"] - tokens),
+        )
+        return packed, stats
+
+
+def create_context_packer(embeddings=None, vector_store=None):
+    """ContextPacker from config.CONTEXT_CONFIG, embeddings and stored chunk
+    vectors are only used when use_embeddings is set."""
+    context_config = dict(config.CONTEXT_CONFIG)
+    if not context_config.pop("use_embeddings"):
+        embeddings = None
+    return ContextPacker(embeddings, vector_store=vector_store, **context_config)
+
+
+def report_packing(stats):
+    """Print the packing stats and add them to the tracing metrics."""
+    print(
+        f"Context: {stats['kept_chunks']}/{stats['input_chunks']} chunks, "
+        f"{stats['tokens']} tokens ({stats['tokens_saved']} saved, "
+        f"{stats['duplicates']} duplicates)"
+    )
+    increment("rag_context_tokens_total", stats["tokens"])
+    increment("rag_context_tokens_saved_total", stats["tokens_saved"])
+    increment("rag_context_duplicates_total", stats["duplicates"])
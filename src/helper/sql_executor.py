@@ -0,0 +1,200 @@
+import queue
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+import pandas as pd
+
+from src import config
+
+
+class QueryTimeoutError(RuntimeError):
+    """Raised when a query runs longer than the executor's time limit."""
+
+
+# Statements a read-only query may need, anything else is denied
+_ALLOWED_ACTIONS = {
+    sqlite3.SQLITE_SELECT,
+    sqlite3.SQLITE_READ,
+    sqlite3.SQLITE_FUNCTION,
+    sqlite3.SQLITE_RECURSIVE,
+}
+
+_LIMIT_PATTERN = re.compile(r"\blimit\s+\d+(\s*(,|offset)\s*\d+)?\s*$", re.IGNORECASE)
+
+
+class ReadOnlyConnectionPool:
+    """Pool of read-only (mode=ro) SQLite connections to one database.
+
+    # Example usage:
+    pool = ReadOnlyConnectionPool("databases/Main.db", size=4)
+    with pool.connection() as conn:
+        conn.execute("SELECT 1")
+    """
+
+    def __init__(self, db_path, size=4) -> None:
+        self.db_path = db_path
+        self.size = size
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+
+    def _connect(self):
+        return sqlite3.connect(
+            f"file:{self.db_path}?mode=ro", uri=True, check_same_thread=False
+        )
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection, blocks while all of them are in use."""
+        self._slots.acquire()
+        try:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                conn = self._connect()
+            try:
+                yield conn
+            finally:
+                conn.set_authorizer(None)
+                conn.set_progress_handler(None, 0)
+                self._idle.put(conn)
+        finally:
+            self._slots.release()
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+class QueryExecutor:
+    """Runs read-only SQL against an SQLite database.
+
+    Queries run on pooled read-only connections with an authorizer that only
+    allows reads, a wall-clock time limit enforced by a progress handler and
+    an automatic LIMIT on selects without one. Results are streamed in pages.
+
+    # Example usage:
+    executor = QueryExecutor("databases/Main.db", timeout=5.0, max_rows=1000)
+    executor.referenced_tables("SELECT * FROM EMPLOYEE_TRACKER")
+    for page in executor.iter_pages("SELECT * FROM EMPLOYEE_TRACKER"):
+        print(page)
+    """
+
+    def __init__(
+        self, db_path, pool_size=4, timeout=5.0, max_rows=1000, page_size=200
+    ) -> None:
+        self.pool = ReadOnlyConnectionPool(db_path, size=pool_size)
+        self.timeout = timeout
+        self.max_rows = max_rows
+        self.page_size = page_size
+
+    def referenced_tables(self, query):
+        """Tables read by the query, as resolved by SQLite's own parser.
+
+        Names come from the authorizer's SQLITE_READ callbacks while the
+        query is compiled, plus the tables and indexes the compiled program
+        opens, since tables only joined with USING (...) or counted with
+        count(*) get no column read callback.
+
+        Raises sqlite3.Error when the query does not compile, e.g. when it
+        references a table that does not exist.
+        """
+        tables = set()
+
+        def authorizer(action, arg1, arg2, db_name, source):
+            if action == sqlite3.SQLITE_READ and not arg1.startswith("sqlite_"):
+                tables.add(arg1)
+            return sqlite3.SQLITE_OK
+
+        with self.pool.connection() as conn:
+            conn.set_authorizer(authorizer)
+            # EXPLAIN compiles the statement without running it
+            program = conn.execute(f"EXPLAIN {self._strip(query)}").fetchall()
+            conn.set_authorizer(None)
+            # OpenRead opens b-tree p2 of database p3, 0 is main
+            root_pages = {
+                row[3] for row in program if row[1] == "OpenRead" and row[4] == 0
+            }
+            if root_pages:
+                tables.update(
+                    name
+                    for rootpage, name in conn.execute(
+                        "SELECT rootpage, tbl_name FROM sqlite_master "
+                        "WHERE rootpage > 0"
+                    )
+                    if rootpage in root_pages and not name.startswith("sqlite_")
+                )
+        return tables
+
+    def _strip(self, query):
+        return query.strip().rstrip(";").strip()
+
+    def _limit(self, query, max_rows):
+        query = self._strip(query)
+        if max_rows is None:
+            return query
+        is_select = query.split(None, 1)[0].lower() in ("select", "with")
+        if is_select and not _LIMIT_PATTERN.search(query):
+            return f"SELECT * FROM ({query}) LIMIT {int(max_rows)}"
+        return query
+
+    def _read_only(self, action, arg1, arg2, db_name, source):
+        if action in _ALLOWED_ACTIONS:
+            return sqlite3.SQLITE_OK
+        return sqlite3.SQLITE_DENY
+
+    def iter_pages(self, query, params=(), max_rows=-1):
+        """Yield the result as DataFrames of at most page_size rows.
+
+        max_rows defaults to the executor's limit, None disables the
+        automatic LIMIT.
+        """
+        max_rows = self.max_rows if max_rows == -1 else max_rows
+        sql = self._limit(query, max_rows)
+        deadline = time.monotonic() + self.timeout
+
+        with self.pool.connection() as conn:
+            conn.set_authorizer(self._read_only)
+            # A non-zero return interrupts the running statement
+            conn.set_progress_handler(lambda: time.monotonic() > deadline, 1000)
+            try:
+                cursor = conn.execute(sql, params)
+                columns = [description[0] for description in cursor.description]
+                empty = True
+                while True:
+                    rows = cursor.fetchmany(self.page_size)
+                    if not rows:
+                        break
+                    empty = False
+                    yield pd.DataFrame(rows, columns=columns)
+                if empty:
+                    yield pd.DataFrame(columns=columns)
+            except sqlite3.OperationalError as e:
+                if time.monotonic() > deadline:
+                    raise QueryTimeoutError(
+                        f"Query exceeded the {self.timeout}s time limit."
+                    ) from e
+                raise
+
+    def execute(self, query, params=(), max_rows=-1):
+        """Run the query and return the (limited) result as one DataFrame."""
+        pages = list(self.iter_pages(query, params, max_rows=max_rows))
+        return pd.concat(pages, ignore_index=True)
+
+
+_executors = {}
+_executors_lock = threading.Lock()
+
+
+def get_query_executor(db_path=None):
+    """Return the shared QueryExecutor of a database file."""
+    db_path = db_path or config.DB_PATH
+    with _executors_lock:
+        if db_path not in _executors:
+            _executors[db_path] = QueryExecutor(db_path, **config.SQL_EXECUTOR_CONFIG)
+        return _executors[db_path]
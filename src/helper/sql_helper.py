@@ -1,8 +1,31 @@
 import sqlite3
 import pandas as pd
+import itertools
 import os
 import json
 import re
+import threading
+import time
+
+from src.helper.sql_executor import get_query_executor
+
+
+# Columns indexed after loading when a table has them
+DEFAULT_INDEX_COLUMNS = ("store_id", "product_id", "operation_date")
+
+
+def _quote(name):
+    """Quote an SQLite identifier."""
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def _sqlite_type(dtype):
+    """Map a pandas dtype to an SQLite column type."""
+    if pd.api.types.is_bool_dtype(dtype) or pd.api.types.is_integer_dtype(dtype):
+        return "INTEGER"
+    if pd.api.types.is_float_dtype(dtype):
+        return "REAL"
+    return "TEXT"
 
 
 class CSVtoSQLite:
@@ -14,6 +37,9 @@ class CSVtoSQLite:
 
     db_handler = CSVtoSQLite(db_path, db_name)
     db_handler.create_table_from_csv(csv_file, table_name)
+    db_handler.create_table_from_csv(
+        new_csv_file, table_name, mode="upsert", key_columns=["store_id", "product_id"]
+    )
     db_handler.close_connection()
     """
     def __init__(self, db_path, db_name):
@@ -25,22 +51,135 @@ class CSVtoSQLite:
         # Ensure directory exists
         os.makedirs(self.db_path, exist_ok=True)
 
-        self.conn = sqlite3.connect(self.full_db_path)
+        # Transactions are managed explicitly by the loader
+        self.conn = sqlite3.connect(self.full_db_path, isolation_level=None)
         self.cursor = self.conn.cursor()
 
-    def create_table_from_csv(self, csv_file, table_name):
-        """Create a table and insert data from a CSV file."""
+        # Tuned for bulk loads: WAL lets readers continue during a load
+        self.cursor.execute("PRAGMA journal_mode=WAL;")
+        self.cursor.execute("PRAGMA synchronous=NORMAL;")
+        self.cursor.execute("PRAGMA temp_store=MEMORY;")
+        self.cursor.execute("PRAGMA cache_size=-64000;")
+
+    def _create_table(self, table_name, chunk):
+        """Create the table with column types inferred from the first chunk."""
+        columns = ", ".join(
+            f"{_quote(column)} {_sqlite_type(dtype)}"
+            for column, dtype in chunk.dtypes.items()
+        )
+        self.cursor.execute(
+            f"CREATE TABLE IF NOT EXISTS {_quote(table_name)} ({columns})"
+        )
+
+    def _insert_sql(self, table_name, columns, mode, key_columns):
+        names = ", ".join(_quote(column) for column in columns)
+        placeholders = ", ".join("?" * len(columns))
+        sql = f"INSERT INTO {_quote(table_name)} ({names}) VALUES ({placeholders})"
+        if mode != "upsert":
+            return sql
+
+        updates = [c for c in columns if c not in key_columns]
+        conflict = ", ".join(_quote(column) for column in key_columns)
+        if not updates:
+            return f"{sql} ON CONFLICT({conflict}) DO NOTHING"
+        assignments = ", ".join(f"{_quote(c)} = excluded.{_quote(c)}" for c in updates)
+        return f"{sql} ON CONFLICT({conflict}) DO UPDATE SET {assignments}"
+
+    def create_table_from_csv(
+        self,
+        csv_file,
+        table_name,
+        mode="replace",
+        key_columns=None,
+        index_columns=DEFAULT_INDEX_COLUMNS,
+        chunksize=100000,
+    ):
+        """Create or update a table from a CSV file.
+
+        The CSV is streamed in chunks and written in a single transaction with
+        column types inferred from the first chunk, then indexes are built on
+        the index_columns the table has.
+
+        Args:
+            csv_file (str): Path of the CSV file.
+            table_name (str): Table to write to.
+            mode (str): 'replace' recreates the table, 'append' adds the rows and
+                'upsert' inserts or updates rows matching key_columns.
+            key_columns (list): Columns identifying a row, required for 'upsert'.
+            index_columns (list): Columns to index when present in the table.
+            chunksize (int): Rows read from the CSV at a time.
+
+        Returns:
+            dict: rows written, seconds taken and rows per second, or None on error.
+        """
         try:
             if not os.path.exists(csv_file):
                 raise FileNotFoundError(f"File '{csv_file}' not found.")
-            
-            df = pd.read_csv(csv_file)
-            if df.empty:
+            if mode not in ("replace", "append", "upsert"):
+                raise ValueError(
+                    f"Unknown mode '{mode}', use 'replace', 'append' or 'upsert'."
+                )
+            if mode == "upsert" and not key_columns:
+                raise ValueError("key_columns are required to upsert rows.")
+
+            start = time.perf_counter()
+            chunks = pd.read_csv(csv_file, chunksize=chunksize)
+            first_chunk = next(chunks, None)
+            if first_chunk is None or first_chunk.empty:
                 raise ValueError(f"CSV file '{csv_file}' is empty.")
-            
-            df.to_sql(table_name, self.conn, if_exists='replace', index=False)
-            print(f"Table '{table_name}' created in database '{self.full_db_path}' from '{csv_file}'.")
-        
+
+            columns = list(first_chunk.columns)
+            insert_sql = self._insert_sql(table_name, columns, mode, key_columns or [])
+            rows = 0
+
+            self.cursor.execute("BEGIN")
+            try:
+                if mode == "replace":
+                    self.cursor.execute(f"DROP TABLE IF EXISTS {_quote(table_name)}")
+                self._create_table(table_name, first_chunk)
+                if mode == "upsert":
+                    key_names = ", ".join(_quote(column) for column in key_columns)
+                    self.cursor.execute(
+                        f"CREATE UNIQUE INDEX IF NOT EXISTS "
+                        f"{_quote('ux_' + table_name + '_' + '_'.join(key_columns))} "
+                        f"ON {_quote(table_name)} ({key_names})"
+                    )
+
+                for chunk in itertools.chain([first_chunk], chunks):
+                    # Python objects with None for missing values bind directly
+                    chunk = chunk[columns]
+                    chunk = chunk.astype(object).where(chunk.notna(), None)
+                    self.cursor.executemany(
+                        insert_sql, chunk.itertuples(index=False, name=None)
+                    )
+                    rows += len(chunk)
+
+                # Indexes are cheaper to build once the rows are in
+                for column in index_columns:
+                    if column in columns:
+                        self.cursor.execute(
+                            f"CREATE INDEX IF NOT EXISTS "
+                            f"{_quote('idx_' + table_name + '_' + column)} "
+                            f"ON {_quote(table_name)} ({_quote(column)})"
+                        )
+                self.cursor.execute("COMMIT")
+            except Exception:
+                self.cursor.execute("ROLLBACK")
+                raise
+
+            self.cursor.execute("ANALYZE")
+            seconds = time.perf_counter() - start
+            stats = {
+                "rows": rows,
+                "seconds": seconds,
+                "rows_per_sec": rows / seconds if seconds else 0.0,
+            }
+            print(
+                f"Table '{table_name}' loaded ({mode}) in database '{self.full_db_path}' "
+                f"from '{csv_file}': {rows} rows at {stats['rows_per_sec']:.0f} rows/sec."
+            )
+            return stats
+
         except FileNotFoundError as fnf_error:
             print(fnf_error)
         except ValueError as val_error:
@@ -65,11 +204,8 @@ def read_table_from_db(db_name, table_name):
     print(df)
     """
     try:
-        conn = sqlite3.connect(db_name)
-        query = f"SELECT * FROM {table_name}"
-        df = pd.read_sql(query, conn)
-        conn.close()
-        return df
+        query = f"SELECT * FROM {_quote(table_name)}"
+        return get_query_executor(db_name).execute(query, max_rows=None)
     except Exception as e:
         print(f"Error reading table '{table_name}' from '{db_name}': {e}")
 
@@ -78,11 +214,144 @@ def read_table_from_db(db_name, table_name):
 
 
 
+def _validate_db_path(db_path):
+    if not os.path.exists(db_path):
+        raise FileNotFoundError(f"Database file at '{db_path}' does not exist.")
+
+    if not db_path.lower().endswith('.db'):
+        raise ValueError(f"The provided file '{db_path}' is not a valid SQLite database.")
+
+
+class SchemaCatalog:
+    """
+    Cached structure of an SQLite database: tables, columns with data types,
+    row counts and a few sample values per column.
+
+    The structure is served from memory and only re-read when the database
+    file (or its WAL file) changes; tables and columns are only re-read when
+    SQLite's schema_version changes, otherwise just counts and samples.
+
+    # Example usage:
+    # catalog = SchemaCatalog("databases/Main.db")
+    # print(catalog.to_json())
+    """
+    def __init__(self, db_path, sample_size=3):
+        _validate_db_path(db_path)
+        self.db_path = db_path
+        self.sample_size = sample_size
+
+        self._lock = threading.Lock()
+        self._file_state = None
+        self._schema_version = None
+        self._tables = None
+        self._json = None
+
+    def _current_file_state(self):
+        state = []
+        for path in (self.db_path, self.db_path + "-wal"):
+            try:
+                stat = os.stat(path)
+                state.append((stat.st_mtime_ns, stat.st_size))
+            except FileNotFoundError:
+                state.append(None)
+        return tuple(state)
+
+    def _read_tables(self, cursor):
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
+        tables = [row[0] for row in cursor.fetchall() if not row[0].startswith("sqlite_")]
+
+        if not tables:
+            raise ValueError("No tables found in the database.")
+
+        structure = {}
+        for table_name in tables:
+            cursor.execute(f"PRAGMA table_info({_quote(table_name)});")
+            columns = cursor.fetchall()
+
+            if not columns:
+                raise ValueError(f"Could not retrieve columns for table '{table_name}'.")
+
+            structure[table_name] = [(col[1], col[2]) for col in columns]
+        return structure
+
+    def _describe_table(self, cursor, table_name, columns):
+        cursor.execute(f"SELECT COUNT(*) FROM {_quote(table_name)}")
+        row_count = cursor.fetchone()[0]
+
+        column_info = []
+        for name, datatype in columns:
+            cursor.execute(
+                f"SELECT DISTINCT {_quote(name)} FROM {_quote(table_name)} "
+                f"WHERE {_quote(name)} IS NOT NULL LIMIT ?",
+                (self.sample_size,),
+            )
+            column_info.append({
+                "name": name,
+                "datatype": datatype,
+                "sample_values": [row[0] for row in cursor.fetchall()],
+            })
+        return {"table": table_name, "row_count": row_count, "columns": column_info}
+
+    def _refresh(self):
+        conn = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True)
+        try:
+            cursor = conn.cursor()
+            cursor.execute("PRAGMA schema_version;")
+            schema_version = cursor.fetchone()[0]
+            if schema_version != self._schema_version:
+                self._tables = self._read_tables(cursor)
+                self._schema_version = schema_version
+
+            database_info = {
+                "database": self.db_path,
+                "tables": [
+                    self._describe_table(cursor, table_name, columns)
+                    for table_name, columns in self._tables.items()
+                ],
+            }
+            self._json = json.dumps(database_info, indent=4, default=str)
+        except sqlite3.Error as e:
+            raise RuntimeError(f"An error occurred while accessing the database: {e}")
+        finally:
+            conn.close()
+
+    def to_json(self):
+        """Return the database structure as JSON, refreshing it if the file changed."""
+        state = self._current_file_state()
+        if state == self._file_state and self._json is not None:
+            return self._json
+
+        with self._lock:
+            state = self._current_file_state()
+            if state != self._file_state or self._json is None:
+                self._refresh()
+                self._file_state = state
+            return self._json
+
+    def structure(self):
+        return json.loads(self.to_json())
+
+
+_catalogs = {}
+_catalogs_lock = threading.Lock()
+
+
+def get_schema_catalog(db_path: str) -> SchemaCatalog:
+    """Return the shared SchemaCatalog of a database file."""
+    key = os.path.abspath(db_path)
+    with _catalogs_lock:
+        if key not in _catalogs:
+            _catalogs[key] = SchemaCatalog(db_path)
+        return _catalogs[key]
+
 
 def get_database_structure(db_path: str) -> str:
     """
     Retrieves the database structure (tables and columns with data types) from an SQLite database.
-    
+
+    Served from a cached SchemaCatalog, which also includes row counts and
+    sample values per column, and only re-read when the database changes.
+
     Args:
     db_path (str): The path to the SQLite database file.
 
@@ -98,55 +367,11 @@ def get_database_structure(db_path: str) -> str:
     #     print(str(e))
 
     """
-    
-    # Validate the database path
-    if not os.path.exists(db_path):
-        raise FileNotFoundError(f"Database file at '{db_path}' does not exist.")
-    
-    if not db_path.lower().endswith('.db'):
-        raise ValueError(f"The provided file '{db_path}' is not a valid SQLite database.")
-    
-    try:
-        # Connect to the SQLite database
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
 
-        # Fetch the list of tables
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
-        tables = cursor.fetchall()
-
-        if not tables:
-            raise ValueError("No tables found in the database.")
-
-        # Prepare the structure information
-        database_info = {"database": db_path, "tables": []}
-
-        # Loop through each table to get column names and data types
-        for table in tables:
-            table_name = table[0]
-            cursor.execute(f"PRAGMA table_info({table_name});")
-            columns = cursor.fetchall()
-
-            if not columns:
-                raise ValueError(f"Could not retrieve columns for table '{table_name}'.")
-
-            table_info = {
-                "table": table_name,
-                "columns": [{"name": col[1], "datatype": col[2]} for col in columns]
-            }
-            
-            database_info["tables"].append(table_info)
+    # Validate the database path
+    _validate_db_path(db_path)
 
-        # Convert the structure information to JSON format
-        return json.dumps(database_info, indent=4)
-
-    except sqlite3.Error as e:
-        raise RuntimeError(f"An error occurred while accessing the database: {e}")
-    
-    finally:
-        # Ensure the connection is closed
-        if conn:
-            conn.close()
+    return get_schema_catalog(db_path).to_json()
 
 
 def extract_sql_query(text):
@@ -204,32 +429,11 @@ def check_tables_in_query(response_query, database_name):
         else:
             print("Some tables do not exist in the database.")
     """
-    # Connect to the database
-    conn = sqlite3.connect(database_name)
-    cursor = conn.cursor()
-
-    # Extract table names from the query (basic implementation)
-    # This is a simple approach and may need to be enhanced for complex queries
-    tables_in_query = set()
-    words = response_query.split()
-    for word in words:
-        if word.lower() in ["from", "join", "into", "update"]:
-            # The next word is likely a table name
-            table_name = words[words.index(word) + 1].strip(";").strip(",")
-            tables_in_query.add(table_name)
-
-    # Get all tables in the database
-    cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
-    tables_in_db = {row[0] for row in cursor.fetchall()}
-
-    # Check if all tables in the query exist in the database
-    for table in tables_in_query:
-        if table not in tables_in_db:
-            # print(f"Table '{table}' does not exist in the database.")
-            conn.close()
-            return False
-
-    conn.close()
+    # Let SQLite's parser resolve the tables, compiling fails on a missing table
+    try:
+        get_query_executor(database_name).referenced_tables(response_query)
+    except sqlite3.Error:
+        return False
     return True
 
 
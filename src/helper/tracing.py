@@ -0,0 +1,385 @@
+import contextvars
+import json
+import os
+import threading
+import time
+import uuid
+from collections import defaultdict
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+from src import config
+
+# Upper bounds in seconds of the latency histogram buckets
+_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Trace of the question being answered, inherited by the graph's node threads
+_current_trace = contextvars.ContextVar("current_trace", default=None)
+
+
+def _labels(labels):
+    return ",".join(f'{key}="{value}"' for key, value in sorted(labels.items()))
+
+
+class Tracer:
+    """Writes spans to a JSONL trace file and aggregates them as metrics.
+
+    Every span has a kind ("node", "llm", "retriever", "embedding"), a name
+    and a duration. Durations go into per (kind, name) histograms, token,
+    document and cache counters are kept next to them and exported in the
+    Prometheus text format.
+
+    # Example usage:
+    tracer = Tracer("data/traces/trace.jsonl")
+    with tracer.span("embedding", "mxbai-embed-large", texts=3):
+        embeddings.embed_documents(texts)
+    print(tracer.prometheus_text())
+    """
+
+    def __init__(self, trace_path=None, max_bytes=50 * 1024 * 1024) -> None:
+        self.trace_path = trace_path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._histograms = defaultdict(lambda: [0] * (len(_BUCKETS) + 1))
+        self._sums = defaultdict(float)
+        self._counters = defaultdict(float)
+        if trace_path and os.path.dirname(trace_path):
+            os.makedirs(os.path.dirname(trace_path), exist_ok=True)
+
+    def _write(self, record):
+        if not self.trace_path:
+            return
+        line = json.dumps(record, default=str) + "\n"
+        with self._lock:
+            # Keep one previous file around instead of growing without bound
+            if (
+                os.path.exists(self.trace_path)
+                and os.path.getsize(self.trace_path) > self.max_bytes
+            ):
+                os.replace(self.trace_path, self.trace_path + ".1")
+            with open(self.trace_path, "a") as f:
+                f.write(line)
+
+    def record_span(
+        self, kind, name, start, duration, span_id=None, parent_id=None, **attributes
+    ):
+        key = (kind, name)
+        with self._lock:
+            buckets = self._histograms[key]
+            for i, bound in enumerate(_BUCKETS):
+                if duration <= bound:
+                    buckets[i] += 1
+                    break
+            else:
+                buckets[-1] += 1
+            self._sums[key] += duration
+        self._write(
+            {
+                "trace_id": _current_trace.get(),
+                "span_id": str(span_id or uuid.uuid4()),
+                "parent_id": str(parent_id) if parent_id else None,
+                "kind": kind,
+                "name": name,
+                "start": start,
+                "duration_ms": 1000 * duration,
+                **attributes,
+            }
+        )
+
+    @contextmanager
+    def span(self, kind, name, **attributes):
+        start, started = time.time(), time.perf_counter()
+        try:
+            yield attributes
+        finally:
+            self.record_span(
+                kind, name, start, time.perf_counter() - started, **attributes
+            )
+
+    def increment(self, metric, value=1, **labels):
+        with self._lock:
+            self._counters[(metric, _labels(labels))] += value
+
+    def record_cache(self, cache, hits, misses=0):
+        self.increment("rag_cache_requests_total", hits, cache=cache, result="hit")
+        self.increment("rag_cache_requests_total", misses, cache=cache, result="miss")
+
+    def prometheus_text(self):
+        lines = [
+            "# HELP rag_span_duration_seconds Duration of graph nodes, LLM, "
+            "retriever and embedding calls.",
+            "# TYPE rag_span_duration_seconds histogram",
+        ]
+        with self._lock:
+            for (kind, name), buckets in sorted(self._histograms.items()):
+                labels = _labels({"kind": kind, "name": name})
+                cumulative = 0
+                for bound, count in zip(_BUCKETS + ("+Inf",), buckets):
+                    cumulative += count
+                    lines.append(
+                        f'rag_span_duration_seconds_bucket{{{labels},le="{bound}"}} '
+                        f"{cumulative}"
+                    )
+                lines.append(
+                    f"rag_span_duration_seconds_sum{{{labels}}} "
+                    f"{self._sums[(kind, name)]}"
+                )
+                lines.append(
+                    f"rag_span_duration_seconds_count{{{labels}}} {cumulative}"
+                )
+
+            metrics = sorted({metric for metric, _ in self._counters})
+            for metric in metrics:
+                lines.append(f"# TYPE {metric} counter")
+                for (name, labels), value in sorted(self._counters.items()):
+                    if name == metric:
+                        lines.append(f"{metric}{{{labels}}} {value:g}")
+        return "\n".join(lines) + "\n"
+
+    def write_metrics(self, path):
+        """Atomically write the Prometheus text, e.g. for a textfile collector."""
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(self.prometheus_text())
+        os.replace(tmp_path, path)
+
+
+class TracingCallbackHandler(BaseCallbackHandler):
+    """Turns LangChain callbacks into tracer spans.
+
+    Graph nodes, chat model and retriever runs become spans, chat model
+    token counts (Ollama's prompt_eval_count / eval_count or usage
+    metadata) and retrieved document counts become counters.
+    """
+
+    def __init__(self, tracer, metrics_path=None) -> None:
+        self.tracer = tracer
+        self.metrics_path = metrics_path
+        self._runs = {}
+        self._trace_tokens = {}
+        self._lock = threading.Lock()
+
+    def _start(self, run_id, kind, name, parent_run_id, **attributes):
+        with self._lock:
+            self._runs[run_id] = (
+                kind,
+                name,
+                parent_run_id,
+                time.time(),
+                time.perf_counter(),
+                attributes,
+            )
+
+    def _end(self, run_id, **attributes):
+        with self._lock:
+            run = self._runs.pop(run_id, None)
+        if run is None:
+            return None
+        kind, name, parent_run_id, start, started, start_attributes = run
+        self.tracer.record_span(
+            kind,
+            name,
+            start,
+            time.perf_counter() - started,
+            span_id=run_id,
+            parent_id=parent_run_id,
+            **start_attributes,
+            **attributes,
+        )
+        return kind, name
+
+    def on_chain_start(
+        self, serialized, inputs, *, run_id, parent_run_id=None, metadata=None, **kwargs
+    ):
+        if parent_run_id is None:
+            # Root of the graph run, everything below belongs to this trace
+            self._trace_tokens[run_id] = _current_trace.set(str(run_id))
+            self._start(run_id, "graph", kwargs.get("name") or "graph", None)
+            return
+        node = (metadata or {}).get("langgraph_node")
+        if node is not None and kwargs.get("name") == node:
+            self._start(run_id, "node", node, parent_run_id)
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        documents = outputs.get("documents") if isinstance(outputs, dict) else None
+        attributes = {} if documents is None else {"documents": len(documents)}
+        ended = self._end(run_id, **attributes)
+        if ended is not None and ended[0] == "node" and documents is not None:
+            self.tracer.increment(
+                "rag_node_documents_total", len(documents), node=ended[1]
+            )
+        self._end_trace(run_id)
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        ended = self._end(run_id, error=repr(error))
+        if ended is not None:
+            self.tracer.increment("rag_errors_total", kind=ended[0], name=ended[1])
+        self._end_trace(run_id)
+
+    def _end_trace(self, run_id):
+        token = self._trace_tokens.pop(run_id, None)
+        if token is None:
+            return
+        try:
+            _current_trace.reset(token)
+        except ValueError:
+            # Ended from another context than it started in
+            _current_trace.set(None)
+        if self.metrics_path:
+            self.tracer.write_metrics(self.metrics_path)
+
+    def on_chat_model_start(
+        self,
+        serialized,
+        messages,
+        *,
+        run_id,
+        parent_run_id=None,
+        metadata=None,
+        **kwargs,
+    ):
+        model = (
+            (metadata or {}).get("ls_model_name")
+            or kwargs.get("name")
+            or (serialized or {}).get("name")
+            or "llm"
+        )
+        self._start(run_id, "llm", model, parent_run_id)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        prompt_tokens = completion_tokens = 0
+        for generations in response.generations:
+            for generation in generations:
+                message = getattr(generation, "message", None)
+                usage = getattr(message, "usage_metadata", None)
+                info = generation.generation_info or {}
+                if usage:
+                    prompt_tokens += usage.get("input_tokens", 0)
+                    completion_tokens += usage.get("output_tokens", 0)
+                else:
+                    prompt_tokens += info.get("prompt_eval_count") or 0
+                    completion_tokens += info.get("eval_count") or 0
+        ended = self._end(
+            run_id, prompt_tokens=prompt_tokens, completion_tokens=completion_tokens
+        )
+        if ended is not None:
+            model = ended[1]
+            self.tracer.increment(
+                "rag_llm_prompt_tokens_total", prompt_tokens, model=model
+            )
+            self.tracer.increment(
+                "rag_llm_completion_tokens_total", completion_tokens, model=model
+            )
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error=repr(error))
+        self.tracer.increment("rag_errors_total", kind="llm", name="llm")
+
+    def on_retriever_start(
+        self, serialized, query, *, run_id, parent_run_id=None, **kwargs
+    ):
+        self._start(
+            run_id, "retriever", kwargs.get("name") or "retriever", parent_run_id
+        )
+
+    def on_retriever_end(self, documents, *, run_id, **kwargs):
+        self._end(run_id, documents=len(documents))
+
+    def on_retriever_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error=repr(error))
+
+
+class _MetricsRequestHandler(BaseHTTPRequestHandler):
+    tracer = None
+
+    def do_GET(self):
+        if self.path.rstrip("/") != "/metrics":
+            self.send_error(404)
+            return
+        body = self.tracer.prometheus_text().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(tracer, port, host="127.0.0.1"):
+    """Serve tracer metrics on http://host:port/metrics from a daemon thread."""
+    handler = type("MetricsHandler", (_MetricsRequestHandler,), {"tracer": tracer})
+    server = ThreadingHTTPServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"Serving metrics on http://{host}:{port}/metrics")
+    return server
+
+
+_tracer = None
+_handler = None
+_tracer_lock = threading.Lock()
+
+
+def get_tracer():
+    """Process-wide tracer, None when tracing is off (config.DEBUG_FLAG)."""
+    global _tracer, _handler
+    if not config.DEBUG_FLAG:
+        return None
+    with _tracer_lock:
+        if _tracer is None:
+            tracing_config = config.TRACING_CONFIG
+            _tracer = Tracer(
+                tracing_config["trace_path"], max_bytes=tracing_config["max_bytes"]
+            )
+            _handler = TracingCallbackHandler(
+                _tracer, metrics_path=tracing_config["metrics_path"]
+            )
+            if tracing_config["metrics_port"]:
+                try:
+                    start_metrics_server(_tracer, tracing_config["metrics_port"])
+                except OSError as e:
+                    # e.g. another worker process already serves the port
+                    print(f"Metrics server not started: {e}")
+        return _tracer
+
+
+def with_tracing(run_config=None):
+    """Return run_config with the tracing callback handler added when enabled."""
+    if get_tracer() is None:
+        return run_config
+    run_config = dict(run_config or {})
+    callbacks = run_config.get("callbacks") or []
+    if isinstance(callbacks, list):
+        run_config["callbacks"] = callbacks + [_handler]
+    else:
+        # A callback manager, handlers are added to it instead
+        callbacks.add_handler(_handler, inherit=True)
+    return run_config
+
+
+@contextmanager
+def span(kind, name, **attributes):
+    """Tracer span when tracing is enabled, otherwise a no-op."""
+    tracer = get_tracer()
+    if tracer is None:
+        yield attributes
+        return
+    with tracer.span(kind, name, **attributes) as span_attributes:
+        yield span_attributes
+
+
+def increment(metric, value=1, **labels):
+    tracer = get_tracer()
+    if tracer is not None:
+        tracer.increment(metric, value, **labels)
+
+
+def record_cache(cache, hits, misses=0):
+    tracer = get_tracer()
+    if tracer is not None:
+        tracer.record_cache(cache, hits, misses)
@@ -1,8 +1,14 @@
 from langchain_community.chat_models import ChatOllama
 from langgraph.graph import END, MessageGraph, StateGraph, START
-from langgraph.checkpoint.memory import MemorySaver
 
-from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage
+from langchain_core.messages import (
+    AIMessage,
+    BaseMessage,
+    HumanMessage,
+    RemoveMessage,
+    SystemMessage,
+)
+from langchain_core.messages.utils import count_tokens_approximately, trim_messages
 from langgraph.graph.message import add_messages
 
 from IPython.display import Image, display
@@ -10,14 +16,36 @@ from langchain_core.pydantic_v1 import BaseModel, Field
 from typing import List, TypedDict, Annotated, Sequence
 from langchain_core.runnables.graph import MermaidDrawMethod
 from langchain_core.output_parsers import JsonOutputParser, StrOutputParser
+from langchain_core.runnables import ensure_config
 from typing_extensions import Literal
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from collections import OrderedDict
+from contextlib import nullcontext
+import contextvars
+import threading
+import time
 
 from langchain.globals import set_llm_cache
-from langchain.cache import SQLiteCache
 
 
-from src.models.rag import create_retriver
+from src.data.embeddings import get_embeddings
+from src.models.rag import create_retriver, get_index_version
+from src.models.rerank import create_reranker
+from src.models.semantic_cache import SemanticCache
+from src.models.llm_cache import create_llm_cache
+from src.models.memory import LatestCheckpointSaver
+from src.models.router import EmbeddingRouter
+from src.models.retrievers import tokenize
 from src.helper.utlis import format_docs
+from src.helper.context import create_context_packer, report_packing
+from src.helper.tracing import record_cache, with_tracing
+from src.helper.sql_executor import get_query_executor
+from src.helper.sql_helper import (
+    check_tables_in_query,
+    clean_response,
+    extract_sql_query,
+    get_database_structure,
+)
 from src.models.prompt import (
     create_ragqa_prompt,
     create_rerank_prompt,
@@ -25,10 +53,63 @@ from src.models.prompt import (
     create_qe_prompt,
     create_hallucination_prompt,
     create_answer_grader_prompt,
+    create_sql_generation_prompt,
+    create_contextualize_prompt,
+    create_summary_prompt,
 )
 from src import config
 
-set_llm_cache(SQLiteCache(database_path=config.LLM_CACHE_PATH))
+set_llm_cache(create_llm_cache())
+
+# Runs query expansion off the critical path of retrieval
+_expansion_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="expand-query")
+
+# Summarizes long conversations after the answer has been returned
+_summary_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="summarize")
+
+# Words that carry no topic, a question made of little else is a follow-up
+_FILLER_WORDS = {
+    "a", "about", "and", "an", "are", "can", "do", "does", "for", "how", "i",
+    "in", "is", "it", "me", "my", "of", "on", "or", "please", "should", "so",
+    "that", "the", "them", "then", "there", "these", "they", "this", "those",
+    "to", "was", "we", "what", "when", "where", "which", "who", "why", "with",
+    "you",
+}  # fmt: skip
+
+# Words that point back to something said earlier in the conversation
+_REFERRING_WORDS = {
+    "it", "its", "this", "that", "these", "those", "they", "them", "their",
+    "he", "she", "his", "her", "same", "previous", "above", "else", "again",
+}  # fmt: skip
+
+_FOLLOW_UP_STARTS = ("and ", "also ", "but ", "what about ", "how about ", "then ")
+
+
+def is_follow_up(question):
+    """Whether the question likely depends on earlier turns to be understood,
+    e.g. "what are the steps?" or "and for part-time staff?"."""
+    words = tokenize(question)
+    if not words:
+        return False
+    if question.strip().lower().startswith(_FOLLOW_UP_STARTS):
+        return True
+    if _REFERRING_WORDS.intersection(words):
+        return True
+    return len([word for word in words if word not in _FILLER_WORDS]) <= 1
+
+
+def _format_history(messages):
+    speakers = {"human": "Team member", "ai": "Assistant"}
+    return "\n".join(
+        f"{speakers.get(message.type, message.type)}: {message.content}"
+        for message in messages
+    )
+
+
+def _vector_store(retriever):
+    """Vector store behind a similarity or hybrid retriever, if any."""
+    retriever = getattr(retriever, "vector_retriever", retriever)
+    return getattr(retriever, "vectorstore", None)
 
 
 class GraphState(TypedDict):
@@ -36,13 +117,16 @@ class GraphState(TypedDict):
     Represents the state of our graph.
 
     Attributes:
-        messages: Chat messages
+        question: question being answered, standalone after contextualize
+        messages: Chat messages of the conversation
+        summary: summary of turns removed from messages
         generation: LLM generation
         documents: list of documents
     """
 
     question: str
-    # messages: Annotated[Sequence[BaseMessage], add_messages]
+    messages: Annotated[Sequence[BaseMessage], add_messages]
+    summary: str
     generation: str
     documents: List[str]
 
@@ -63,60 +147,240 @@ class Feedback(BaseModel):
 
 
 class ChatAgent:
+    """RAG and SQL question answering graph.
 
-    def __init__(self) -> None:
-        self.messages = []
-        self.llm = ChatOllama(**config.MODEL_CONFIG)
-        self.retriver = create_retriver()
+    The LLM, retriever and embeddings default to the configured Ollama
+    models and index, they can be passed in to run the graph against other
+    backends (e.g. the local stand-ins of src/models/benchmark.py).
+    """
+
+    def __init__(
+        self,
+        llm=None,
+        retriver=None,
+        embeddings=None,
+        grader_type=None,
+        use_cache=True,
+    ) -> None:
+        self.llm = llm or ChatOllama(**config.MODEL_CONFIG)
+        self.retriver = retriver or create_retriver()
+        self.embeddings = embeddings
+        self.grader_type = grader_type or config.GRADER_TYPE
+        self.reranker = create_reranker(self.grader_type)
+        self.cache = self._create_cache() if use_cache else None
+        self.router = self._create_router()
+        self.context_packer = create_context_packer(
+            self.embeddings or get_embeddings(), _vector_store(self.retriver)
+        )
+        # Conversation state per thread (e.g. Streamlit session)
+        self.memory = (
+            LatestCheckpointSaver() if config.MEMORY_CONFIG["enabled"] else None
+        )
+        self._thread_locks = {}
+        self._last_used = OrderedDict()
+        self._summarizing = set()
+        self._threads_lock = threading.Lock()
         self.workflow = None
         self.agent = None
+        self._stateless_agent = None
 
     def build(self):
         self._create_workflow()
 
+    def _create_cache(self):
+        cache_config = dict(config.SEMANTIC_CACHE_CONFIG)
+        if not cache_config.pop("enabled"):
+            return None
+        embeddings = self.embeddings or get_embeddings()
+        return SemanticCache(
+            embeddings, index_version=get_index_version, **cache_config
+        )
+
+    def _create_router(self):
+        router_config = dict(config.ROUTER_CONFIG)
+        if not router_config.pop("enabled"):
+            return None
+        return EmbeddingRouter(
+            self.embeddings or get_embeddings(),
+            fallback=self._llm_route,
+            **router_config,
+        )
+
     def _create_workflow(self):
         self.workflow = StateGraph(GraphState)
+        self.workflow.add_node("contextualize", self._contextualize)
         self.workflow.add_node("grade_docs", self._retrivel_grader)
         self.workflow.add_node("retrieve", self._retrive_docs)
         self.workflow.add_node("generate", self._rag_qa)
         self.workflow.add_node("evaluate", self._evaluate_response)
-        # self.workflow.add_node("sql_qa", self._sql_agent)
+        self.workflow.add_node("sql_qa", self._sql_agent)
         # self.workflow.add_node("expand_query", self._expand_query)
 
-        self.workflow.add_edge(START, "retrieve")
         # self.workflow.add_edge(START, "expand_query")
-        # self.workflow.add_conditional_edges(
-        #     START,
-        #     self._route_model,
-        #     {
-        #         "rag": "retrieve",
-        #         "db": "sql_qa",
-        #     },
-        # )
+        self.workflow.add_edge(START, "contextualize")
+        self.workflow.add_conditional_edges(
+            "contextualize",
+            self._route_model,
+            {
+                "rag": "retrieve",
+                "db": "sql_qa",
+            },
+        )
         self.workflow.add_edge("retrieve", "grade_docs")
         self.workflow.add_edge("grade_docs", "generate")
         self.workflow.add_edge("generate", END)
         # self.workflow.add_edge("generate", "evaluate")
         # self.workflow.add_edge("evaluate", END)
-        # self.workflow.add_edge("sql_qa", END)
-        self.agent = self.workflow.compile()
+        self.workflow.add_edge("sql_qa", END)
+        self.agent = self.workflow.compile(checkpointer=self.memory)
+        # Questions without a thread are not remembered
+        self._stateless_agent = self.workflow.compile()
+
+    def _contextualize(self, state):
+        """Add the question to the conversation and, if it is a follow-up,
+        rewrite it into a standalone question using the recent history."""
+        question = state["question"]
+        update = {"messages": [HumanMessage(content=question)]}
+        history = state.get("messages") or []
+        if not history or not is_follow_up(question):
+            return update
+
+        # Hard budget on the history sent to the LLM, newest turns first
+        history = trim_messages(
+            history,
+            max_tokens=config.MEMORY_CONFIG["max_history_tokens"],
+            token_counter=count_tokens_approximately,
+            strategy="last",
+            start_on="human",
+        )
+        prompt = create_contextualize_prompt()
+        contextualize = prompt | self.llm | StrOutputParser()
+        try:
+            standalone = contextualize.invoke(
+                {
+                    "summary": state.get("summary") or "None",
+                    "history": _format_history(history),
+                    "question": question,
+                }
+            ).strip()
+        except Exception as e:
+            print(f"Contextualizing the question failed: {e}")
+            return update
+        if standalone:
+            print(f"Contextualized Query: {standalone}")
+            update["question"] = standalone
+        return update
 
     def _retrive_docs(self, state):
         question = state["question"]
+        expansion_config = config.QUERY_EXPANSION_CONFIG
+        if expansion_config["mode"] != "speculative":
+            documents = self.retriver.get_relevant_documents(question)
+            return {"documents": documents, "question": question}
+
+        # Expand the query while retrieving for the original question, the
+        # expanded results are only merged if they arrive before the deadline
+        deadline = time.monotonic() + expansion_config["deadline"]
+        # The node's run config (callbacks, tags) is passed on and its context
+        # copied, so the expansion is traced as part of this node
+        expanded = _expansion_pool.submit(
+            contextvars.copy_context().run,
+            self._retrieve_expanded,
+            question,
+            deadline,
+            ensure_config(),
+        )
         documents = self.retriver.get_relevant_documents(question)
+        try:
+            expanded_docs = expanded.result(timeout=max(0, deadline - time.monotonic()))
+        except TimeoutError:
+            # Drops it if still queued, a running one stops at the deadline
+            expanded.cancel()
+            print("Query expansion missed the deadline, using original results.")
+            expanded_docs = []
+        except Exception as e:
+            print(f"Query expansion failed: {e}")
+            expanded_docs = []
+
+        seen = {doc.id or doc.page_content for doc in documents}
+        for doc in expanded_docs:
+            key = doc.id or doc.page_content
+            if key not in seen:
+                seen.add(key)
+                documents.append(doc)
 
         return {"documents": documents, "question": question}
 
-    def _route_model(self, state):
+    def _retrieve_expanded(self, question, deadline=None, run_config=None):
+        """Documents for the expanded question, nothing once deadline (a
+        time.monotonic() value) has passed since the answer moved on."""
+
+        def expired():
+            return deadline is not None and time.monotonic() >= deadline
+
+        if expired():
+            return []
+        expanded_question = self._expand_question(question, run_config)
+        if expired():
+            return []
+        if expanded_question.strip().lower() == question.strip().lower():
+            return []
+        return self.retriver.invoke(expanded_question, config=run_config)
+
+    def _llm_route(self, question):
         prompt = create_router_prompt()
 
         router = prompt | self.llm | JsonOutputParser()
 
-        question = state["question"]
-        # router.invoke()
+        try:
+            source = router.invoke({"question": question})
+        except Exception:
+            return "rag"
+        if isinstance(source, dict) and source.get("datasource") == "database":
+            return "db"
+        return "rag"
+
+    def _route_model(self, state):
+        if self.router is None:
+            return "rag"
+        route, confidence = self.router.route(state["question"])
+        print(f"Route: {route} ({confidence:.3f})")
+        return route
 
     def _sql_agent(self, state):
-        pass
+        question = state["question"]
+
+        prompt = create_sql_generation_prompt()
+        sql_chain = prompt | self.llm | StrOutputParser()
+        response = sql_chain.invoke(
+            {
+                "user_input": question,
+                "table_related_info": get_database_structure(config.DB_PATH),
+            }
+        )
+        query = extract_sql_query(response) or clean_response(response.strip())
+        print(f"SQL Query: {query}")
+
+        if not check_tables_in_query(query, config.DB_PATH):
+            generation = "Sorry I couldn't find the store data needed for the question."
+        else:
+            try:
+                result = get_query_executor(config.DB_PATH).execute(query)
+                generation = (
+                    result.to_string(index=False)
+                    if not result.empty
+                    else "No matching store records found."
+                )
+            except Exception as e:
+                print(f"SQL execution failed: {e}")
+                generation = "Sorry I couldn't get the store data for the question."
+
+        return {
+            "documents": [],
+            "question": question,
+            "generation": generation,
+            "messages": [AIMessage(content=generation)],
+        }
 
     def _evaluate_response(self, state):
         """_summary_
@@ -172,15 +436,19 @@ I can answers questions about store procedures, policies and other related topic
         #         "generation": generation,
         #     }
 
-    def _expand_query(self, state):
+    def _expand_question(self, question, run_config=None):
         prompt = create_qe_prompt()
 
         expand_query = prompt | self.llm | StrOutputParser()
 
-        question = state["question"]
-        expanded_question = expand_query.invoke({"question": question})
+        expanded_question = expand_query.invoke(
+            {"question": question}, config=run_config
+        )
         print(f"Expanded Query: {expanded_question}")
-        return {"question": expanded_question}
+        return expanded_question
+
+    def _expand_query(self, state):
+        return {"question": self._expand_question(state["question"])}
 
     def _retrivel_grader(self, state):
         """_summary_
@@ -191,31 +459,41 @@ I can answers questions about store procedures, policies and other related topic
         Returns:
             _type_: _description_
         """
-        prompt = create_rerank_prompt()
-        retrieval_grader = prompt | self.llm | JsonOutputParser()
-
         print("Check Document Relevance")
         question = state["question"]
         documents = state["documents"]
 
-        # Score each doc
+        if self.grader_type == "none":
+            return {"documents": documents, "question": question}
+
+        if self.grader_type == "crossencoder":
+            filtered_docs = self.reranker.rerank(question, documents)
+            return {"documents": filtered_docs, "question": question}
+
+        prompt = create_rerank_prompt()
+        retrieval_grader = prompt | self.llm | JsonOutputParser()
+
+        # Score all docs concurrently, batch keeps the input order
+        scores = retrieval_grader.batch(
+            [{"question": question, "document": doc.page_content} for doc in documents],
+            config={"max_concurrency": config.GRADER_MAX_CONCURRENCY},
+            return_exceptions=True,
+        )
+
         filtered_docs = []
-        for doc in documents:
-            score = retrieval_grader.invoke(
-                {"question": question, "document": doc.page_content}
-            )
+        for doc, score in zip(documents, scores):
             print(score)
-            grade = score["score"]
-            if grade == "yes":
-                filtered_docs.append(doc)
-            else:
+            if isinstance(score, Exception) or not isinstance(score, dict):
                 continue
+            if score.get("score") == "yes":
+                filtered_docs.append(doc)
         return {"documents": filtered_docs, "question": question}
 
     def _rag_qa(self, state):
         prompt = create_ragqa_prompt()
         question = state["question"]
-        documents = state["documents"]
+        documents, stats = self.context_packer.pack(question, state["documents"])
+        report_packing(stats)
         rag_chain = prompt | self.llm | StrOutputParser()
         generation = rag_chain.invoke(
             {"context": format_docs(documents), "question": question}
@@ -225,10 +503,227 @@ I can answers questions about store procedures, policies and other related topic
             "documents": documents,
             "question": question,
             "generation": generation,
+            "messages": [AIMessage(content=generation)],
+        }
+
+    def _cache_lookup(self, question):
+        """Return (cached_state, question_vector) for the question."""
+        if self.cache is None:
+            return None, None
+        entry, vector = self.cache.lookup(question["question"])
+        record_cache("semantic", int(entry is not None), int(entry is None))
+        if entry is None:
+            return None, vector
+        state = {
+            "question": question["question"],
+            "generation": entry["generation"],
+            "documents": entry["documents"],
         }
+        return state, vector
+
+    def _cache_update(self, question, vector, state):
+        # Only grounded answers are worth serving again
+        if self.cache is not None and state.get("documents"):
+            self.cache.update(question["question"], vector, state)
+
+    def _thread_config(self, thread_id):
+        return {"configurable": {"thread_id": thread_id}}
+
+    def _thread_lock(self, thread_id):
+        """Serializes turns and summary updates of one conversation."""
+        if self.memory is None or thread_id is None:
+            return nullcontext()
+        with self._threads_lock:
+            return self._thread_locks.setdefault(thread_id, threading.Lock())
+
+    def _touch(self, thread_id):
+        """Mark the thread as used now and forget conversations that were
+        idle longer than idle_ttl or are the oldest beyond max_threads."""
+        if self.memory is None or thread_id is None:
+            return
+        memory_config = config.MEMORY_CONFIG
+        now = time.monotonic()
+        expired = []
+        with self._threads_lock:
+            self._last_used[thread_id] = now
+            self._last_used.move_to_end(thread_id)
+            # Oldest first, stops at the first thread that is kept
+            for other, used in self._last_used.items():
+                over_limit = (
+                    len(self._last_used) - len(expired) > memory_config["max_threads"]
+                )
+                if other == thread_id or (
+                    not over_limit and now - used < memory_config["idle_ttl"]
+                ):
+                    break
+                lock = self._thread_locks.get(other)
+                if other in self._summarizing or (lock is not None and lock.locked()):
+                    continue
+                expired.append(other)
+            for other in expired:
+                del self._last_used[other]
+                self._thread_locks.pop(other, None)
+        for other in expired:
+            self.memory.delete_thread(other)
+        if expired:
+            print(f"Forgot {len(expired)} idle conversations.")
+
+    def _graph(self, thread_id):
+        if self.memory is None or thread_id is None:
+            return self._stateless_agent
+        return self.agent
+
+    def _run_config(self, run_config, thread_id):
+        run_config = dict(with_tracing(run_config) or {})
+        if self.memory is not None and thread_id is not None:
+            run_config["configurable"] = {
+                **run_config.get("configurable", {}),
+                "thread_id": thread_id,
+            }
+        return run_config
+
+    def _history(self, thread_id):
+        if self.memory is None or thread_id is None:
+            return []
+        state = self.agent.get_state(self._thread_config(thread_id))
+        return state.values.get("messages") or []
+
+    def _is_contextual(self, question, thread_id):
+        """Follow-ups depend on the conversation, so they skip the answer cache."""
+        return bool(self._history(thread_id)) and is_follow_up(question["question"])
+
+    def _remember(self, thread_id, question, state):
+        """Record a turn answered without running the graph (cache hit)."""
+        if self.memory is None or thread_id is None:
+            return
+        self.agent.update_state(
+            self._thread_config(thread_id),
+            {
+                "messages": [
+                    HumanMessage(content=question["question"]),
+                    AIMessage(content=state["generation"]),
+                ]
+            },
+            as_node="generate",
+        )
+
+    def _schedule_summary(self, thread_id):
+        """Summarize older turns in the background once the history is over
+        the token budget, so the next turn does not wait for it."""
+        memory_config = config.MEMORY_CONFIG
+        if self.memory is None or thread_id is None:
+            return
+        messages = self._history(thread_id)
+        if (
+            count_tokens_approximately(messages)
+            <= memory_config["summarize_after_tokens"]
+        ):
+            return
+        with self._threads_lock:
+            if thread_id in self._summarizing:
+                return
+            self._summarizing.add(thread_id)
+        _summary_pool.submit(self._summarize, thread_id)
+
+    def _summarize(self, thread_id):
+        thread_config = self._thread_config(thread_id)
+        try:
+            values = self.agent.get_state(thread_config).values
+            messages = values.get("messages") or []
+            older = messages[: -config.MEMORY_CONFIG["keep_messages"]]
+            if not older:
+                return
+            prompt = create_summary_prompt()
+            summarize = prompt | self.llm | StrOutputParser()
+            summary = summarize.invoke(
+                {
+                    "summary": values.get("summary") or "None",
+                    "history": _format_history(older),
+                }
+            ).strip()
+            # Turns added meanwhile are kept, only the summarized ones go
+            with self._thread_lock(thread_id):
+                self.agent.update_state(
+                    thread_config,
+                    {
+                        "summary": summary,
+                        "messages": [RemoveMessage(id=m.id) for m in older],
+                    },
+                    as_node="generate",
+                )
+            print(f"Summarized {len(older)} messages of conversation {thread_id}.")
+        except Exception as e:
+            print(f"Summarizing the conversation failed: {e}")
+        finally:
+            with self._threads_lock:
+                self._summarizing.discard(thread_id)
+
+    def chat(self, question, run_config=None, thread_id=None):
+        """Answer the question, remembering the turn in thread_id's conversation."""
+        self._touch(thread_id)
+        contextual = self._is_contextual(question, thread_id)
+        cached, vector = (None, None) if contextual else self._cache_lookup(question)
+
+        with self._thread_lock(thread_id):
+            if cached is not None:
+                self._remember(thread_id, question, cached)
+                return cached
+            state = self._graph(thread_id).invoke(
+                question, config=self._run_config(run_config, thread_id)
+            )
+
+        if not contextual:
+            self._cache_update(question, vector, state)
+        self._schedule_summary(thread_id)
+        return state
 
-    def chat(self, question):
-        return self.agent.invoke(question)
+    def stream(self, question, run_config=None, thread_id=None):
+        """Run the graph and yield events as they happen.
+
+        Yields ("status", node, update) once each node has finished,
+        ("token", text, None) for every generated token and finally
+        ("final", state, None) with the full graph state. run_config (e.g.
+        callbacks) is passed on to the graph, thread_id keeps the
+        conversation history.
+        """
+        self._touch(thread_id)
+        contextual = self._is_contextual(question, thread_id)
+        cached, vector = (None, None) if contextual else self._cache_lookup(question)
+        if cached is not None:
+            with self._thread_lock(thread_id):
+                self._remember(thread_id, question, cached)
+            yield "status", "cache", cached
+            yield "token", cached["generation"], None
+            yield "final", cached, None
+            return
+
+        state = dict(question)
+        streamed = False
+        with self._thread_lock(thread_id):
+            for mode, payload in self._graph(thread_id).stream(
+                question,
+                config=self._run_config(run_config, thread_id),
+                stream_mode=["updates", "messages"],
+            ):
+                if mode == "messages":
+                    chunk, metadata = payload
+                    if metadata.get("langgraph_node") == "generate" and chunk.content:
+                        streamed = True
+                        yield "token", chunk.content, None
+                    continue
+
+                for node, update in payload.items():
+                    update = update or {}
+                    state.update(update)
+                    # Cached generations and database answers come back whole
+                    if node == "sql_qa" or (node == "generate" and not streamed):
+                        yield "token", update.get("generation", ""), None
+                    yield "status", node, update
+
+        if not contextual:
+            self._cache_update(question, vector, state)
+        self._schedule_summary(thread_id)
+        yield "final", state, None
 
     def display_graph(self):
         if self.workflow:
@@ -0,0 +1,612 @@
+import argparse
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Iterator, List, Optional
+
+import numpy as np
+from langchain_chroma import Chroma
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import (
+    AIMessage,
+    AIMessageChunk,
+    BaseMessage,
+    HumanMessage,
+)
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from pydantic import PrivateAttr
+
+from src import config
+from src.data.chunking import SemanticChunkingEngine
+from src.data.data_loader import DataLoader
+from src.data.embeddings import EmbeddingWriter
+from src.data.vector_store import NumpyVectorStore
+from src.helper.context import count_tokens
+from src.models.agent import ChatAgent
+from src.models.llm_cache import TemplateNamespaces, template_text
+from src.models.prompt import PROMPT_BUILDERS
+from src.models.retrievers import BM25Index, HybridRetriever, tokenize
+from src.models.warmup import prompt_eval, uncached, warmup
+from src.models.router import ROUTE_EXAMPLES
+
+_TEMPLATES = TemplateNamespaces(
+    {name: template_text(build()) for name, build in PROMPT_BUILDERS.items()}
+)
+
+# Canned responses of the simulated LLM per prompt template
+_RESPONSES = {
+    "rerank": '{"score": "yes"}',
+    "hallucination": '{"score": "yes"}',
+    "answer_grader": '{"score": "yes"}',
+    "answer_eval": '{"score": "yes"}',
+    "router": '{"datasource": "vectorstore"}',
+    "relevant_table": '["EMPLOYEE_TRACKER"]',
+    "summary": "The team member asked about store procedures for backfilling stock.",
+}
+
+_ANSWER_WORDS = (
+    "the team member should follow the store procedure and check with the "
+    "manager before completing the backfill of stock on the shop floor"
+).split()
+
+
+class SimulatedChatModel(BaseChatModel):
+    """Deterministic local stand-in for ChatOllama.
+
+    Answers are chosen by the prompt template the messages were built from
+    (graders say yes, the router picks the vectorstore, SQL generation
+    returns sql_query) and are streamed token by token. Latency is
+    prefill_latency plus prompt_token_latency per prompt token before the
+    first token, then token_latency per token.
+
+    Like Ollama, the prompts of the last kv_slots requests are kept and
+    only the part of a prompt after the longest prefix shared with one of
+    them is evaluated again. prompt_eval_count and prompt_eval_duration
+    are reported in the generation info the same way.
+
+    # Example usage:
+    llm = SimulatedChatModel(prefill_latency=0.2, token_latency=0.02)
+    (create_ragqa_prompt() | llm).invoke({"question": "...", "context": "..."})
+    """
+
+    prefill_latency: float = 0.05
+    prompt_token_latency: float = 0.0
+    token_latency: float = 0.005
+    answer_tokens: int = 40
+    kv_slots: int = 4
+    sql_query: str = "SELECT * FROM EMPLOYEE_TRACKER LIMIT 5"
+    # Never answered from the global LLM cache
+    cache: Any = False
+    _kv_cache: list = PrivateAttr(default_factory=list)
+    _kv_lock: Any = PrivateAttr(default_factory=threading.Lock)
+
+    @property
+    def _llm_type(self) -> str:
+        return "simulated-ollama"
+
+    def _response(self, messages):
+        prompt = "\n".join(str(message.content) for message in messages)
+        name = _TEMPLATES.resolve(prompt).split(":")[0]
+        if name in _RESPONSES:
+            return _RESPONSES[name]
+        if name == "sql_generation":
+            return self.sql_query
+        if name == "query_expansion":
+            return prompt.rsplit("Question:", 1)[-1].strip() + " store procedure"
+        if name == "contextualize":
+            return prompt.rsplit("Follow-up question:", 1)[-1].strip()
+        seed = int(hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:8], 16)
+        rng = random.Random(seed)
+        return " ".join(rng.choice(_ANSWER_WORDS) for _ in range(self.answer_tokens))
+
+    def _prefill(self, messages):
+        """Sleep for the prompt evaluation, returns the Ollama style info."""
+        prompt = "".join(f"<{message.type}>{message.content}" for message in messages)
+        with self._kv_lock:
+            cached = max(
+                (len(os.path.commonprefix([prompt, slot])) for slot in self._kv_cache),
+                default=0,
+            )
+            self._kv_cache.insert(0, prompt)
+            del self._kv_cache[self.kv_slots :]
+        evaluated = count_tokens(prompt[cached:])
+        duration = self.prefill_latency + self.prompt_token_latency * evaluated
+        time.sleep(duration)
+        return {
+            "prompt_eval_count": evaluated,
+            "prompt_eval_duration": int(duration * 1e9),
+        }
+
+    def _tokens(self, messages, info, num_predict=None):
+        info.update(self._prefill(messages))
+        tokens = self._response(messages).split(" ")[:num_predict]
+        info["eval_count"] = len(tokens)
+        for token in tokens:
+            time.sleep(self.token_latency)
+            yield token
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager=None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        info = {}
+        text = " ".join(self._tokens(messages, info, kwargs.get("num_predict")))
+        return ChatResult(
+            generations=[
+                ChatGeneration(message=AIMessage(content=text), generation_info=info)
+            ]
+        )
+
+    def _stream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager=None,
+        **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        info = {}
+        for i, token in enumerate(
+            self._tokens(messages, info, kwargs.get("num_predict"))
+        ):
+            chunk = ChatGenerationChunk(
+                message=AIMessageChunk(content=token if i == 0 else " " + token)
+            )
+            if run_manager:
+                run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+        # Ollama sends its counters with the final, empty chunk
+        yield ChatGenerationChunk(
+            message=AIMessageChunk(content=""), generation_info=info
+        )
+
+
+class SimulatedEmbeddings(Embeddings):
+    """Deterministic local stand-in for OllamaEmbeddings.
+
+    Vectors hash the words of the text into size buckets, so texts sharing
+    words are similar. Every request sleeps latency plus text_latency per
+    text, like a round trip to the embedding server.
+    """
+
+    def __init__(self, size=1024, latency=0.01, text_latency=0.001) -> None:
+        self.size = size
+        self.latency = latency
+        self.text_latency = text_latency
+
+    def _vector(self, text):
+        vector = np.zeros(self.size, dtype=np.float32)
+        for token in tokenize(text):
+            digest = int(hashlib.md5(token.encode("utf-8")).hexdigest()[:8], 16)
+            vector[digest % self.size] += 1.0 if digest & 1 else -1.0
+        norm = np.linalg.norm(vector)
+        if norm == 0:
+            vector[0], norm = 1.0, 1.0
+        return (vector / norm).tolist()
+
+    def embed_documents(self, texts):
+        time.sleep(self.latency + self.text_latency * len(texts))
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text):
+        time.sleep(self.latency + self.text_latency)
+        return self._vector(text)
+
+
+class NodeTimer(BaseCallbackHandler):
+    """Collects the wall time of every graph node run.
+
+    Routing runs as the conditional edge after "contextualize", so its time
+    is counted in that node's.
+    """
+
+    def __init__(self) -> None:
+        self.durations = defaultdict(list)
+        self._starts = {}
+        self._lock = threading.Lock()
+
+    def on_chain_start(self, serialized, inputs, *, run_id, metadata=None, **kwargs):
+        node = (metadata or {}).get("langgraph_node")
+        if node is not None and kwargs.get("name") == node:
+            with self._lock:
+                self._starts[run_id] = (node, time.perf_counter())
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        with self._lock:
+            started = self._starts.pop(run_id, None)
+            if started is not None:
+                node, start = started
+                self.durations[node].append(time.perf_counter() - start)
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        with self._lock:
+            self._starts.pop(run_id, None)
+
+
+def load_questions(path="Questions.txt"):
+    with open(path) as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def synthetic_questions(n, seed=0):
+    """n questions varied from the router examples, the same for a seed."""
+    rng = random.Random(seed)
+    examples = [q for questions in ROUTE_EXAMPLES.values() for q in questions]
+    prefixes = ["", "Hi, ", "quick question: ", "can you tell me ", "hello "]
+    suffixes = ["", " please", " thanks", " in my store", " for the weekend"]
+    return [
+        rng.choice(prefixes) + rng.choice(examples) + rng.choice(suffixes)
+        for _ in range(n)
+    ]
+
+
+def _percentiles(values):
+    if not values:
+        return {"count": 0}
+    values_ms = 1000 * np.asarray(values)
+    return {
+        "count": len(values),
+        "mean_ms": float(values_ms.mean()),
+        "p50_ms": float(np.percentile(values_ms, 50)),
+        "p95_ms": float(np.percentile(values_ms, 95)),
+        "p99_ms": float(np.percentile(values_ms, 99)),
+    }
+
+
+def benchmark_ingestion(embeddings, folder_path=config.RAW_DATA_PATH, copies=1):
+    """Chunk and write the documents of folder_path (copies times) into an
+    in-memory Chroma collection.
+
+    Returns:
+        tuple: (stats, db, chunks, ids)
+    """
+    docs = DataLoader(max_workers=config.LOADER_MAX_WORKERS).load_data_from_folder(
+        folder_path
+    )
+    docs = [
+        Document(
+            page_content=doc.page_content,
+            metadata={**doc.metadata, "copy": i},
+        )
+        for i in range(copies)
+        for doc in docs
+    ]
+
+    start = time.perf_counter()
+    engine = SemanticChunkingEngine(
+        embeddings,
+        batch_size=config.EMBEDDING_BATCH_SIZE,
+        vector_mode=config.CHUNK_VECTOR_MODE,
+    )
+    chunks, vectors = engine.split_documents(docs)
+    chunking_seconds = time.perf_counter() - start
+
+    if config.VECTOR_STORE == "numpy":
+        index_config = dict(config.NUMPY_INDEX_CONFIG, path=None)
+        db = NumpyVectorStore(embeddings, **index_config)
+    else:
+        db = Chroma(
+            collection_name=f"benchmark-{uuid.uuid4().hex[:8]}",
+            embedding_function=embeddings,
+        )
+    ids = [f"benchmark-{i}" for i in range(len(chunks))]
+    writer = EmbeddingWriter(
+        db,
+        embeddings,
+        batch_size=config.EMBEDDING_BATCH_SIZE,
+        max_workers=config.EMBEDDING_MAX_WORKERS,
+    )
+    write_stats = writer.write(chunks, ids, vectors=vectors)
+    seconds = time.perf_counter() - start
+    stats = {
+        "documents": len(docs),
+        "chunks": len(chunks),
+        "chunking_seconds": chunking_seconds,
+        "write_seconds": write_stats["seconds"],
+        "chunks_per_sec": len(chunks) / seconds if seconds else 0.0,
+    }
+    if isinstance(db, NumpyVectorStore):
+        # Stored vectors must find themselves, whatever the quantization
+        stats["self_recall"] = db.self_recall()
+    return stats, db, chunks, ids
+
+
+def _create_retriever(db, chunks, ids):
+    retriever_config = config.RETRIEVER_CONFIG
+    if retriever_config["search_type"] != "hybrid":
+        return db.as_retriever(
+            search_type="similarity", search_kwargs={"k": retriever_config["k"]}
+        )
+    lexical_index = BM25Index()
+    lexical_index.add_documents(ids, chunks)
+    return HybridRetriever(
+        vector_retriever=db.as_retriever(
+            search_type="similarity",
+            search_kwargs={"k": retriever_config["fetch_k"]},
+        ),
+        lexical_index_provider=lambda: lexical_index,
+        k=retriever_config["k"],
+        fetch_k=retriever_config["fetch_k"],
+        rrf_k=retriever_config["rrf_k"],
+    )
+
+
+def _ask(agent, question, timer):
+    """Stream one question, returns (end-to-end seconds, first token seconds)."""
+    start = time.perf_counter()
+    first_token = None
+    for kind, value, _ in agent.stream(
+        {"question": question}, run_config={"callbacks": [timer]}
+    ):
+        if kind == "token" and value and first_token is None:
+            first_token = time.perf_counter() - start
+    return time.perf_counter() - start, first_token
+
+
+def run_benchmark(
+    questions,
+    sessions=(1, 4, 8),
+    llm_latency=0.05,
+    token_latency=0.005,
+    embedding_latency=0.01,
+    ingest_copies=1,
+    grader_type="llm",
+    prompt_token_latency=0.0,
+):
+    """Ingest the raw documents and answer questions at each concurrency level.
+
+    Every level answers all questions, spread over that many concurrent
+    sessions. Node and latency percentiles are taken over all levels.
+    """
+    embeddings = SimulatedEmbeddings(latency=embedding_latency)
+    llm = SimulatedChatModel(
+        prefill_latency=llm_latency,
+        prompt_token_latency=prompt_token_latency,
+        token_latency=token_latency,
+    )
+
+    print("Benchmarking ingestion...")
+    ingestion, db, chunks, ids = benchmark_ingestion(embeddings, copies=ingest_copies)
+
+    # The semantic cache would answer repeated questions without the graph
+    agent = ChatAgent(
+        llm=llm,
+        retriver=_create_retriever(db, chunks, ids),
+        embeddings=embeddings,
+        grader_type=grader_type,
+        use_cache=False,
+    )
+    agent.build()
+
+    timer = NodeTimer()
+    end_to_end, first_token, throughput = [], [], {}
+    for n_sessions in sessions:
+        print(f"Answering {len(questions)} questions with {n_sessions} sessions...")
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=n_sessions) as pool:
+            results = list(pool.map(lambda q: _ask(agent, q, timer), questions))
+        elapsed = time.perf_counter() - start
+        throughput[str(n_sessions)] = len(questions) / elapsed
+        end_to_end.extend(total for total, _ in results)
+        first_token.extend(first for _, first in results if first is not None)
+
+    return {
+        "settings": {
+            "questions": len(questions),
+            "sessions": list(sessions),
+            "llm_latency": llm_latency,
+            "token_latency": token_latency,
+            "prompt_token_latency": prompt_token_latency,
+            "embedding_latency": embedding_latency,
+            "ingest_copies": ingest_copies,
+            "grader_type": grader_type,
+            "vector_store": config.VECTOR_STORE,
+        },
+        "ingestion": ingestion,
+        "nodes": {
+            node: _percentiles(values)
+            for node, values in sorted(timer.durations.items())
+        },
+        "end_to_end": _percentiles(end_to_end),
+        "first_token": _percentiles(first_token),
+        "throughput_qps": throughput,
+    }
+
+
+def _variables_first(prompt, values):
+    """Messages in the layout the prompts had before they were split into a
+    system prefix and a human suffix: a single message with the variable
+    parts ahead of the instructions, so calls share no prefix."""
+    system, human = prompt.format_messages(**values)
+    return [HumanMessage(content=f"{human.content}\n{system.content}")]
+
+
+def benchmark_prefill(llm, prompts=None, rounds=5):
+    """Prefill time and evaluated prompt tokens per call, as reported by the
+    model, with the variables first and behind the static system prefix.
+
+    The model is warmed up first, then every round sends each prompt once
+    with new variables, the way a request interleaves them.
+    """
+    prompts = prompts or config.WARMUP_CONFIG["prompts"]
+    llm = uncached(llm)
+    report = {"warmup": warmup(llm, prompts)}
+    # Only the prefill is measured, a single token is enough to get it
+    llm = llm.bind(num_predict=1)
+    layouts = {
+        "variables_first": _variables_first,
+        "system_prefix": lambda prompt, values: prompt.format_messages(**values),
+    }
+    for layout, render in layouts.items():
+        durations, tokens = [], []
+        for question in synthetic_questions(rounds, seed=len(layout)):
+            for name in prompts:
+                prompt = PROMPT_BUILDERS[name]()
+                values = {
+                    name: f"{name}: {question}" for name in prompt.input_variables
+                }
+                stats = prompt_eval(llm.invoke(render(prompt, values)))
+                durations.append(stats["prompt_eval_ms"] / 1000)
+                tokens.append(stats["prompt_tokens"])
+        report[layout] = {
+            "prompt_eval": _percentiles(durations),
+            "prompt_tokens": float(np.mean(tokens)),
+        }
+    return report
+
+
+def _flatten(report, prefix=""):
+    values = {}
+    for key, value in report.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            values.update(_flatten(value, name + "."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            values[name] = value
+    return values
+
+
+def compare_reports(report, baseline, tolerance=0.1):
+    """Relative change of every metric against the baseline.
+
+    Latencies (*_ms, *_seconds) regress when they grow by more than
+    tolerance, throughputs when they drop by more than tolerance.
+    """
+    current, previous = _flatten(report), _flatten(baseline)
+    rows = []
+    for name in sorted(set(current) & set(previous)):
+        higher_is_better = name.startswith("throughput") or name.endswith("per_sec")
+        if not higher_is_better and not name.endswith(("_ms", "_seconds")):
+            continue
+        before, after = previous[name], current[name]
+        change = (after - before) / before if before else 0.0
+        worse = -change if higher_is_better else change
+        rows.append(
+            {
+                "metric": name,
+                "baseline": before,
+                "current": after,
+                "change": change,
+                "regression": worse > tolerance,
+            }
+        )
+    return rows
+
+
+def print_comparison(rows):
+    for row in rows:
+        flag = "  REGRESSION" if row["regression"] else ""
+        print(
+            f"{row['metric']:<40} {row['baseline']:>12.2f} {row['current']:>12.2f} "
+            f"{100 * row['change']:>+8.1f}%{flag}"
+        )
+
+
+def save_report(report, path):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    benchmark_config = config.BENCHMARK_CONFIG
+    parser = argparse.ArgumentParser(description="Offline latency benchmark.")
+    parser.add_argument("--questions", default=benchmark_config["questions_path"])
+    parser.add_argument(
+        "--synthetic", type=int, default=benchmark_config["synthetic_questions"]
+    )
+    parser.add_argument(
+        "--sessions", type=int, nargs="+", default=benchmark_config["sessions"]
+    )
+    parser.add_argument(
+        "--llm-latency", type=float, default=benchmark_config["llm_latency"]
+    )
+    parser.add_argument(
+        "--token-latency", type=float, default=benchmark_config["token_latency"]
+    )
+    parser.add_argument(
+        "--prompt-token-latency",
+        type=float,
+        default=benchmark_config["prompt_token_latency"],
+    )
+    parser.add_argument(
+        "--embedding-latency",
+        type=float,
+        default=benchmark_config["embedding_latency"],
+    )
+    parser.add_argument(
+        "--ingest-copies", type=int, default=benchmark_config["ingest_copies"]
+    )
+    parser.add_argument("--grader", default=benchmark_config["grader_type"])
+    parser.add_argument("--baseline", default=benchmark_config["baseline_path"])
+    parser.add_argument("--output", default=benchmark_config["output_path"])
+    parser.add_argument(
+        "--save-baseline",
+        action="store_true",
+        help="Store this run as the baseline instead of comparing with it.",
+    )
+    parser.add_argument(
+        "--prefill",
+        action="store_true",
+        help="Only compare the prefill time of the prompt layouts.",
+    )
+    parser.add_argument(
+        "--ollama",
+        action="store_true",
+        help="Run the prefill comparison against the configured Ollama model.",
+    )
+    args = parser.parse_args()
+
+    if args.prefill:
+        if args.ollama:
+            from langchain_community.chat_models import ChatOllama
+
+            llm = ChatOllama(**config.MODEL_CONFIG)
+        else:
+            llm = SimulatedChatModel(
+                prefill_latency=args.llm_latency,
+                prompt_token_latency=args.prompt_token_latency,
+                token_latency=args.token_latency,
+            )
+        report = benchmark_prefill(llm, rounds=benchmark_config["prefill_rounds"])
+        save_report(report, benchmark_config["prefill_output_path"])
+        print(json.dumps(report, indent=2))
+    else:
+        questions = load_questions(args.questions) + synthetic_questions(args.synthetic)
+        report = run_benchmark(
+            questions,
+            sessions=args.sessions,
+            llm_latency=args.llm_latency,
+            token_latency=args.token_latency,
+            embedding_latency=args.embedding_latency,
+            ingest_copies=args.ingest_copies,
+            grader_type=args.grader,
+            prompt_token_latency=args.prompt_token_latency,
+        )
+        save_report(report, args.output)
+        print(json.dumps(report, indent=2))
+
+        if args.save_baseline:
+            save_report(report, args.baseline)
+            print(f"Baseline saved to {args.baseline}")
+        elif os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+            if baseline.get("settings") != report["settings"]:
+                print("Warning: baseline was run with different settings.")
+            print_comparison(compare_reports(report, baseline))
+        else:
+            print(f"No baseline at {args.baseline}, run with --save-baseline first.")
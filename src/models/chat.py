@@ -1,15 +1,96 @@
+import threading
+
 from src.models.agent import ChatAgent
+from src.models.rag import reset_lexical_index, update_document_embedding
+from src.models.warmup import start_warmup
+from src import config
 
 from PIL import Image
 
 import streamlit as st
 
 
-def generate_response(input):
-    agent = ChatAgent()
-    agent.build()
+_agent = None
+_agent_key = None
+_agent_lock = threading.Lock()
+
+
+def _config_key():
+    """Settings the built agent depends on, a change forces a rebuild."""
+    return repr(
+        (
+            sorted(config.MODEL_CONFIG.items()),
+            sorted(config.EMBEDDING_MODEL_CONFIG.items()),
+            config.EMBEDDING_PATH,
+            config.VECTOR_STORE,
+        )
+    )
+
+
+def get_agent():
+    """Return the process-wide ChatAgent, building it once on first use.
+
+    The compiled graph holds no per-request state so a single instance is
+    shared by every session and thread. Use this outside of Streamlit.
+    """
+    global _agent, _agent_key
+    key = _config_key()
+    agent = _agent
+    if agent is not None and _agent_key == key:
+        return agent
+
+    with _agent_lock:
+        if _agent is None or _agent_key != key:
+            agent = ChatAgent()
+            agent.build()
+            if config.WARMUP_CONFIG["enabled"]:
+                start_warmup(agent.llm)
+            _agent, _agent_key = agent, key
+        return _agent
+
+
+@st.cache_resource(show_spinner="Loading assistant...")
+def load_agent(config_key):
+    """Streamlit resource cache in front of the process-wide agent.
+
+    config_key is only used as the cache key so a config change misses.
+    """
+    return get_agent()
+
+
+def invalidate_agent():
+    """Drop the shared agent so the next call rebuilds it.
+
+    Call this after the document index or config has changed.
+    """
+    global _agent, _agent_key
+    with _agent_lock:
+        _agent, _agent_key = None, None
+    # The lexical index may belong to another store or index version
+    reset_lexical_index()
+    load_agent.clear()
+
+
+def refresh_index():
+    """Sync the index with the raw documents and drop the agent if it changed."""
+    report = update_document_embedding()
+    if report["added"] or report["modified"] or report["removed"]:
+        invalidate_agent()
+    return report
+
+
+def generate_response(input, thread_id=None):
+    agent = load_agent(_config_key())
+
+    return agent.chat({"question": input}, thread_id=thread_id)
+
+
+def stream_response(input, thread_id=None):
+    """Stream graph events for the question, see ChatAgent.stream. Questions
+    with the same thread_id share the conversation history."""
+    agent = load_agent(_config_key())
 
-    return agent.chat({"question": input})
+    yield from agent.stream({"question": input}, thread_id=thread_id)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,271 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+
+from langchain_core.caches import BaseCache
+from langchain_core.load import dumps, loads
+
+from src.helper.tracing import record_cache
+
+_VARIABLE_PATTERN = re.compile(r"\{[^{}]*\}")
+
+# Namespace of prompts that match no registered template
+DEFAULT_NAMESPACE = "default"
+
+
+def template_text(prompt):
+    """Raw template text of a PromptTemplate or ChatPromptTemplate."""
+    if hasattr(prompt, "template"):
+        return prompt.template
+    parts = []
+    for message in prompt.messages:
+        inner = getattr(message, "prompt", None)
+        if inner is not None and hasattr(inner, "template"):
+            parts.append(inner.template)
+        elif hasattr(message, "content"):
+            parts.append(message.content)
+    return "\n".join(parts)
+
+
+class TemplateNamespaces:
+    """Maps a rendered prompt back to the template it was built from.
+
+    A template matches when all of its literal (non-variable) lines appear
+    in the prompt, either as is or JSON escaped like chat models serialize
+    their messages. The namespace is "<name>:<hash of the template>", so
+    editing a template moves its prompts to a new namespace.
+
+    # Example usage:
+    namespaces = TemplateNamespaces({"rerank": template_text(create_rerank_prompt())})
+    namespaces.resolve(prompt)  # "rerank:3f2a9c1d0b7e"
+    """
+
+    def __init__(self, templates) -> None:
+        self._signatures = []
+        for name, text in templates.items():
+            digest = hashlib.sha256(text.encode("utf-8")).hexdigest()[:12]
+            lines = [
+                line.strip()
+                for segment in _VARIABLE_PATTERN.split(text)
+                for line in segment.splitlines()
+                if line.strip()
+            ]
+            signature = [(line, json.dumps(line)[1:-1]) for line in lines]
+            self._signatures.append((f"{name}:{digest}", signature))
+        # Most specific templates first when one contains another's lines
+        self._signatures.sort(key=lambda item: len(item[1]), reverse=True)
+
+    @property
+    def names(self):
+        return {namespace for namespace, _ in self._signatures}
+
+    def resolve(self, prompt):
+        for namespace, signature in self._signatures:
+            if signature and all(
+                raw in prompt or escaped in prompt for raw, escaped in signature
+            ):
+                return namespace
+        return DEFAULT_NAMESPACE
+
+
+class NamespacedLLMCache(BaseCache):
+    """SQLite LLM cache with template namespaces, TTL and LRU eviction.
+
+    Entries are keyed by (namespace, hash of prompt and llm string). Entries
+    older than ttl seconds are misses and the least recently used ones are
+    evicted above max_entries, which also clears out namespaces of templates
+    that no longer exist. The database runs in WAL mode so several worker
+    processes, possibly running different versions of the prompts, can
+    share it.
+
+    # Example usage:
+    cache = NamespacedLLMCache("data/llm_cache.db", templates=templates)
+    set_llm_cache(cache)
+    cache.metrics()
+    """
+
+    def __init__(
+        self,
+        database_path,
+        templates=None,
+        ttl=7 * 24 * 60 * 60,
+        max_entries=20000,
+        evict_every=100,
+    ) -> None:
+        self.database_path = database_path
+        self.namespaces = TemplateNamespaces(templates or {})
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.evict_every = evict_every
+
+        self._lock = threading.Lock()
+        self._updates = 0
+        self.hits = defaultdict(int)
+        self.misses = defaultdict(int)
+        self.lookup_seconds = 0.0
+        self.update_seconds = 0.0
+        self.evicted = 0
+
+        cache_dir = os.path.dirname(database_path)
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+        # timeout waits for other processes holding the write lock
+        self._conn = sqlite3.connect(database_path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL;")
+        self._conn.execute("PRAGMA synchronous=NORMAL;")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS llm_cache_entries ("
+            "namespace TEXT NOT NULL, key TEXT NOT NULL, response TEXT NOT NULL, "
+            "created_at REAL NOT NULL, last_access REAL NOT NULL, "
+            "PRIMARY KEY (namespace, key))"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS llm_cache_last_access "
+            "ON llm_cache_entries (last_access)"
+        )
+        self._conn.commit()
+
+    def _key(self, prompt, llm_string):
+        return hashlib.sha256(f"{llm_string}\n{prompt}".encode("utf-8")).hexdigest()
+
+    def lookup(self, prompt, llm_string):
+        start = time.perf_counter()
+        namespace = self.namespaces.resolve(prompt)
+        key = self._key(prompt, llm_string)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response, created_at FROM llm_cache_entries "
+                "WHERE namespace = ? AND key = ?",
+                (namespace, key),
+            ).fetchone()
+            generations = None
+            if row is not None and now - row[1] <= self.ttl:
+                try:
+                    generations = [loads(item) for item in json.loads(row[0])]
+                except Exception:
+                    # Written by an incompatible langchain version, treat as a miss
+                    generations = None
+            if generations is not None:
+                self._conn.execute(
+                    "UPDATE llm_cache_entries SET last_access = ? "
+                    "WHERE namespace = ? AND key = ?",
+                    (now, namespace, key),
+                )
+                self._conn.commit()
+                self.hits[namespace] += 1
+            else:
+                self.misses[namespace] += 1
+            self.lookup_seconds += time.perf_counter() - start
+        record_cache("llm", int(generations is not None), int(generations is None))
+        return generations
+
+    def update(self, prompt, llm_string, return_val):
+        start = time.perf_counter()
+        namespace = self.namespaces.resolve(prompt)
+        key = self._key(prompt, llm_string)
+        response = json.dumps([dumps(generation) for generation in return_val])
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_cache_entries "
+                "(namespace, key, response, created_at, last_access) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (namespace, key, response, now, now),
+            )
+            self._conn.commit()
+            self._updates += 1
+            if self._updates % self.evict_every == 0:
+                self._evict()
+            self.update_seconds += time.perf_counter() - start
+
+    def _evict(self):
+        """Drop expired entries, then the least recently used above max_entries."""
+        cursor = self._conn.execute(
+            "DELETE FROM llm_cache_entries WHERE created_at < ?",
+            (time.time() - self.ttl,),
+        )
+        evicted = cursor.rowcount
+        cursor = self._conn.execute(
+            "DELETE FROM llm_cache_entries WHERE rowid IN ("
+            "SELECT rowid FROM llm_cache_entries ORDER BY last_access ASC "
+            "LIMIT max(0, (SELECT COUNT(*) FROM llm_cache_entries) - ?))",
+            (self.max_entries,),
+        )
+        evicted += cursor.rowcount
+        self._conn.commit()
+        self.evicted += evicted
+        return evicted
+
+    def prune(self):
+        """Evict, and drop namespaces of templates that changed or were removed.
+
+        Only run this as maintenance once every process sharing the database
+        runs the same prompts, it deletes the entries of any other version.
+        """
+        with self._lock:
+            keep = self.namespaces.names | {DEFAULT_NAMESPACE}
+            cursor = self._conn.execute(
+                "DELETE FROM llm_cache_entries WHERE namespace NOT IN "
+                f"({','.join('?' * len(keep))})",
+                sorted(keep),
+            )
+            self.evicted += cursor.rowcount
+            self._conn.commit()
+            return cursor.rowcount + self._evict()
+
+    def clear(self, **kwargs):
+        with self._lock:
+            self._conn.execute("DELETE FROM llm_cache_entries")
+            self._conn.commit()
+
+    def metrics(self):
+        with self._lock:
+            hits, misses = sum(self.hits.values()), sum(self.misses.values())
+            lookups = hits + misses
+            size = self._conn.execute(
+                "SELECT COUNT(*) FROM llm_cache_entries"
+            ).fetchone()[0]
+            return {
+                "size": size,
+                "hits": hits,
+                "misses": misses,
+                "hit_rate": hits / lookups if lookups else 0.0,
+                "avg_lookup_ms": (
+                    1000 * self.lookup_seconds / lookups if lookups else 0.0
+                ),
+                "avg_update_ms": (
+                    1000 * self.update_seconds / self._updates if self._updates else 0.0
+                ),
+                "evicted": self.evicted,
+                "namespaces": {
+                    namespace: {
+                        "hits": self.hits[namespace],
+                        "misses": self.misses[namespace],
+                    }
+                    for namespace in set(self.hits) | set(self.misses)
+                },
+            }
+
+
+def create_llm_cache():
+    """NamespacedLLMCache over every template registered in PROMPT_BUILDERS."""
+    from src import config
+    from src.models.prompt import PROMPT_BUILDERS
+
+    templates = {
+        name: template_text(build()) for name, build in PROMPT_BUILDERS.items()
+    }
+    return NamespacedLLMCache(
+        config.LLM_CACHE_PATH, templates=templates, **config.LLM_CACHE_CONFIG
+    )
+
+
+if __name__ == "__main__":
+    # Maintenance: python -m src.models.llm_cache
+    print(f"Pruned {create_llm_cache().prune()} LLM cache entries.")
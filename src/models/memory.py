@@ -0,0 +1,51 @@
+import threading
+
+from langgraph.checkpoint.memory import MemorySaver
+
+
+class LatestCheckpointSaver(MemorySaver):
+    """MemorySaver that only keeps the latest checkpoint of every thread.
+
+    Conversations only ever continue from their latest state, so older
+    checkpoints (one per graph step, each with the full state) are dropped
+    when a new one is saved, together with their pending writes and the
+    channel values only they refer to. Memory then grows with the number of
+    threads, not with the number of turns.
+
+    # Example usage:
+    graph = workflow.compile(checkpointer=LatestCheckpointSaver())
+    graph.invoke(state, config={"configurable": {"thread_id": "session-1"}})
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._prune_lock = threading.Lock()
+        # Channel versions of the latest checkpoint per (thread, namespace)
+        self._versions = {}
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        # Prunes MemorySaver's storage, writes and blobs, whose layout is
+        # private, see the langgraph-checkpoint pin in requirements.txt
+        saved = super().put(config, checkpoint, metadata, new_versions)
+        thread_id = saved["configurable"]["thread_id"]
+        checkpoint_ns = saved["configurable"]["checkpoint_ns"]
+        versions = dict(checkpoint["channel_versions"])
+        with self._prune_lock:
+            checkpoints = self.storage[thread_id][checkpoint_ns]
+            for checkpoint_id in [
+                key for key in checkpoints if key != checkpoint["id"]
+            ]:
+                del checkpoints[checkpoint_id]
+                self.writes.pop((thread_id, checkpoint_ns, checkpoint_id), None)
+            previous = self._versions.get((thread_id, checkpoint_ns), {})
+            for channel, version in previous.items():
+                if versions.get(channel) != version:
+                    self.blobs.pop((thread_id, checkpoint_ns, channel, version), None)
+            self._versions[(thread_id, checkpoint_ns)] = versions
+        return saved
+
+    def delete_thread(self, thread_id):
+        with self._prune_lock:
+            super().delete_thread(thread_id)
+            for key in [key for key in self._versions if key[0] == thread_id]:
+                del self._versions[key]
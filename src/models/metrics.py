@@ -1,35 +1,219 @@
-from ragas import evaluate
-from ragas.metrics import (
-    answer_relevancy,
-    faithfulness,
-    context_recall,
-    context_precision,
-)
-from src.models.rag import RAGSearch
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 import pandas as pd
+from langchain_core.output_parsers import JsonOutputParser
 
+from src import config
+from src.helper.utlis import format_docs
+from src.models.llm_cache import template_text
+from src.models.prompt import create_answer_grader_prompt, create_hallucination_prompt
 
-def rag_evaluation(chat_model, embed_model):
-    """_summary_"""
-    evaluation_data = pd.DataFrame([])
-
-    result = evaluate(
-        evaluation_data["eval"],
-        metrics=[
-            context_precision,
-            faithfulness,
-            answer_relevancy,
-            context_recall,
-        ],
-        llm=chat_model,
-        embeddings=embed_model,
-        raise_exceptions=False,
+
+def _hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def load_golden_set(path=None):
+    """Golden questions, one JSON object per line with "question" and the
+    "expected_sources" (file names) that should be retrieved for it."""
+    path = path or config.EVALUATION_CONFIG["golden_path"]
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def retrieval_metrics(documents, expected_sources):
+    """Hit and reciprocal rank of the first document from an expected source."""
+    expected = {os.path.basename(source) for source in expected_sources}
+    for rank, doc in enumerate(documents, start=1):
+        if os.path.basename(doc.metadata.get("source", "")) in expected:
+            return {"hit": 1, "reciprocal_rank": 1.0 / rank}
+    return {"hit": 0, "reciprocal_rank": 0.0}
+
+
+class JudgeCache:
+    """Judge verdicts keyed by (metric, judge, question, context hash,
+    answer hash), the judge being a hash of the judge model and prompt.
+
+    A row is only judged again when its question, retrieved context or
+    answer changed since the last evaluation run, or when the judge model
+    or its prompt did.
+    """
+
+    def __init__(self, path) -> None:
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL;")
+        # Verdicts of the old schema don't say which judge gave them
+        self._conn.execute("DROP TABLE IF EXISTS judgments")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS judge_verdicts ("
+            "metric TEXT, judge TEXT, question TEXT, context_hash TEXT, "
+            "answer_hash TEXT, verdict TEXT, "
+            "PRIMARY KEY (metric, judge, question, context_hash, answer_hash))"
+        )
+        self._conn.commit()
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT verdict FROM judge_verdicts WHERE metric = ? AND judge = ? "
+                "AND question = ? AND context_hash = ? AND answer_hash = ?",
+                key,
+            ).fetchone()
+        return None if row is None else row[0]
+
+    def put(self, key, verdict):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO judge_verdicts VALUES (?, ?, ?, ?, ?, ?)",
+                (*key, verdict),
+            )
+            self._conn.commit()
+
+
+class RAGEvaluator:
+    """Runs a golden set through ChatAgent in parallel and scores every row.
+
+    Retrieval hit rate and MRR are computed from the retriever's results
+    against the expected sources. Faithfulness (hallucination prompt) and
+    relevance (answer grader prompt) are judged by the LLM, with verdicts
+    cached in a JudgeCache.
+
+    # Example usage:
+    evaluator = RAGEvaluator(agent, JudgeCache("data/eval/judge_cache.db"))
+    results, summary = evaluator.evaluate(load_golden_set())
+    """
+
+    def __init__(self, agent, judge_cache, judge_llm=None, max_workers=4) -> None:
+        self.agent = agent
+        self.judge_cache = judge_cache
+        self.judge_llm = judge_llm or agent.llm
+        self.max_workers = max_workers
+        prompts = {
+            "faithfulness": create_hallucination_prompt(),
+            "relevance": create_answer_grader_prompt(),
+        }
+        self._judges = {
+            metric: prompt | self.judge_llm | JsonOutputParser()
+            for metric, prompt in prompts.items()
+        }
+        # A changed judge model or prompt must not reuse the old verdicts
+        model = getattr(self.judge_llm, "model", None) or type(self.judge_llm).__name__
+        self._judge_keys = {
+            metric: _hash(f"{model}\n{template_text(prompt)}")
+            for metric, prompt in prompts.items()
+        }
+
+    def _judge(self, metric, question, context, answer):
+        """Return (score, cached), score is 1, 0 or None if the judge failed."""
+        key = (
+            metric,
+            self._judge_keys[metric],
+            question,
+            _hash(context),
+            _hash(answer),
+        )
+        verdict = self.judge_cache.get(key)
+        if verdict is not None:
+            return int(verdict == "yes"), True
+
+        inputs = {"question": question, "documents": context, "generation": answer}
+        try:
+            result = self._judges[metric].invoke(inputs)
+            verdict = str(result.get("score", "")).strip().lower()
+        except Exception as e:
+            print(f"Judge {metric} failed for '{question}': {e}")
+            return None, False
+        if verdict not in ("yes", "no"):
+            return None, False
+        self.judge_cache.put(key, verdict)
+        return int(verdict == "yes"), False
+
+    def evaluate_item(self, item):
+        question = item["question"]
+        retrieved = self.agent.retriver.invoke(question)
+        row = {
+            "question": question,
+            "expected_sources": "; ".join(item["expected_sources"]),
+            "retrieved_sources": "; ".join(
+                os.path.basename(doc.metadata.get("source", "")) for doc in retrieved
+            ),
+            **retrieval_metrics(retrieved, item["expected_sources"]),
+        }
+
+        start = time.perf_counter()
+        state = self.agent.chat({"question": question})
+        row["latency_s"] = time.perf_counter() - start
+        answer = state.get("generation", "")
+        context = format_docs(state.get("documents") or [])
+        row["answer"] = answer
+
+        judge_calls = 0
+        for metric in ("faithfulness", "relevance"):
+            if metric == "faithfulness" and not context:
+                # Database answers have no documents to be grounded in
+                row[metric] = None
+                continue
+            row[metric], cached = self._judge(metric, question, context, answer)
+            judge_calls += not cached
+        row["judge_calls"] = judge_calls
+        return row
+
+    def evaluate(self, items):
+        """Return (results DataFrame, summary dict) for the golden items."""
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            rows = list(pool.map(self.evaluate_item, items))
+        results = pd.DataFrame(rows)
+        summary = {
+            "questions": len(results),
+            "hit_rate": float(results["hit"].mean()),
+            "mrr": float(results["reciprocal_rank"].mean()),
+            "faithfulness": float(results["faithfulness"].astype(float).mean()),
+            "relevance": float(results["relevance"].astype(float).mean()),
+            "judge_calls": int(results["judge_calls"].sum()),
+            "p50_latency_s": float(results["latency_s"].median()),
+        }
+        return results, summary
+
+
+def rag_evaluation(agent=None, golden_path=None, results_path=None):
+    """Evaluate the agent on the golden set and write the results table."""
+    from src.models.agent import ChatAgent
+
+    evaluation_config = config.EVALUATION_CONFIG
+    if agent is None:
+        # Cached answers would hide changes to the pipeline being evaluated
+        agent = ChatAgent(use_cache=False)
+        agent.build()
+
+    evaluator = RAGEvaluator(
+        agent,
+        JudgeCache(evaluation_config["judge_cache_path"]),
+        max_workers=evaluation_config["max_workers"],
     )
+    results, summary = evaluator.evaluate(load_golden_set(golden_path))
+
+    results_path = results_path or evaluation_config["results_path"]
+    if os.path.dirname(results_path):
+        os.makedirs(os.path.dirname(results_path), exist_ok=True)
+    results.to_csv(results_path, index=False)
+    print(f"Results written to {results_path}")
+    print(json.dumps(summary, indent=2))
+    return results, summary
+
 
-    results = result.to_pandas()
-    return results
+def agent_evaluation(agent=None):
+    """Evaluate a built ChatAgent on the golden set, see rag_evaluation."""
+    return rag_evaluation(agent=agent)
 
 
-def agent_evaluation():
-    pass
+if __name__ == "__main__":
+    rag_evaluation()
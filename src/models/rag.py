@@ -1,45 +1,244 @@
-from src.data.embeddings import generate_embeddings
+from src.data.embeddings import (
+    clear_checkpoint,
+    create_embedding_writer,
+    get_embeddings,
+)
 
-from langchain_ollama import OllamaEmbeddings
-from langchain_chroma import Chroma
+from langchain_core.documents import Document
 
-from src.data.chunking import semantic_chunker
-from src.data.data_loader import DataLoader
+from src.data.chunking import create_chunking_engine
+from src.data.data_loader import DataLoader, list_data_files
+from src.data.vector_store import create_vector_store, vector_store_file
+from src.models.retrievers import BM25Index, HybridRetriever
 
 from src import config
+import hashlib
+import json
 import os
+import threading
 
+_lexical_index = None
+_lexical_key = None
+_lexical_lock = threading.Lock()
 
-def create_document_embbedding():
-    """_summary_
+
+def _file_hash(file_path):
+    sha = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def load_manifest():
+    """Return the index manifest or None when the index was never built by it
+    or was built for another vector store backend."""
+    if not os.path.exists(config.INDEX_MANIFEST_PATH):
+        return None
+    with open(config.INDEX_MANIFEST_PATH) as f:
+        manifest = json.load(f)
+    if manifest.get("vector_store", "chroma") != config.VECTOR_STORE:
+        return None
+    return manifest
+
+
+def save_manifest(manifest):
+    os.makedirs(os.path.dirname(config.INDEX_MANIFEST_PATH), exist_ok=True)
+    tmp_path = config.INDEX_MANIFEST_PATH + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=4)
+    os.replace(tmp_path, config.INDEX_MANIFEST_PATH)
+
+
+def create_document_embbedding(folder_path=config.RAW_DATA_PATH):
+    """Rebuild the whole index from every file in folder_path.
 
     Returns:
-        _type_: _description_
+        dict: change report, see update_document_embedding.
     """
-    data_loader = DataLoader()
-    docs = data_loader.load_data_from_folder("data/raw/")
-    docs = semantic_chunker(docs)
-    print(len(docs))
-    generate_embeddings(docs=docs)
+    return update_document_embedding(folder_path, rebuild=True)
+
+
+def update_document_embedding(folder_path=config.RAW_DATA_PATH, rebuild=False):
+    """Bring the index in line with folder_path, only touching changed files.
+
+    The manifest maps every indexed file to its content hash and chunk ids.
+    New or modified files are loaded, chunked and embedded, chunks of
+    modified or removed files are deleted from the index. Files that fail
+    to parse are reported as failed and retried on the next run.
+
+    Returns:
+        dict: files added, modified, removed, failed and unchanged plus
+        chunk counts.
+    """
+    manifest = None if rebuild else load_manifest()
+    db = create_vector_store(get_embeddings())
+    if manifest is None:
+        # Chunks not tracked by a manifest can't be updated, start clean
+        print("No index manifest found. Rebuilding all embeddings...")
+        db.reset_collection()
+        # Chunks of a crashed earlier run were just deleted, write them again
+        clear_checkpoint()
+        reset_lexical_index()
+        manifest = {"files": {}, "vector_store": config.VECTOR_STORE}
+
+    indexed = manifest["files"]
+    current = {path: _file_hash(path) for path in list_data_files(folder_path)}
+
+    report = {
+        "added": sorted(set(current) - set(indexed)),
+        "modified": sorted(
+            path
+            for path in set(current) & set(indexed)
+            if current[path] != indexed[path]["hash"]
+        ),
+        "removed": sorted(set(indexed) - set(current)),
+        "unchanged": 0,
+        "chunks_added": 0,
+        "chunks_deleted": 0,
+    }
+    report["unchanged"] = len(current) - len(report["added"]) - len(report["modified"])
+
+    stale_ids = [
+        chunk_id
+        for path in report["modified"] + report["removed"]
+        for chunk_id in indexed[path]["chunk_ids"]
+    ]
+    if stale_ids:
+        db.delete(ids=stale_ids)
+        _update_lexical_index(deleted_ids=stale_ids)
+        report["chunks_deleted"] = len(stale_ids)
+    for path in report["removed"]:
+        del indexed[path]
+
+    data_loader = DataLoader(max_workers=config.LOADER_MAX_WORKERS)
+    chunking_engine = create_chunking_engine()
+    writer = create_embedding_writer(db)
+    # Each file is chunked and embedded as soon as a worker has parsed it,
+    # an interrupted run resumes from the writer checkpoint since the
+    # manifest is only saved once all files are written
+    changed = report["added"] + report["modified"]
+    written = set()
+    for path, docs in data_loader.iter_files(changed):
+        written.add(path)
+        chunks, vectors = chunking_engine.split_documents(docs)
+        for chunk in chunks:
+            chunk.metadata["source"] = path
+        # Ids unique per file and content so identical files don't collide
+        prefix = hashlib.sha256(f"{path}:{current[path]}".encode()).hexdigest()[:16]
+        ids = [f"{prefix}-{i}" for i in range(len(chunks))]
+        if chunks:
+            writer.write(chunks, ids, vectors=vectors, finish=False)
+            _update_lexical_index(added_ids=ids, added_docs=chunks)
+        indexed[path] = {"hash": current[path], "chunk_ids": ids}
+        report["chunks_added"] += len(chunks)
+    writer.finish()
+    # The store may only have been persisted by finish()
+    _update_lexical_index()
+
+    report["failed"] = sorted(set(changed) - written)
+    for path in report["failed"]:
+        # Their old chunks are already deleted, index them as new next time
+        indexed.pop(path, None)
+    report["added"] = [path for path in report["added"] if path in written]
+    report["modified"] = [path for path in report["modified"] if path in written]
+
+    save_manifest(manifest)
+    print(
+        f"Index updated: {len(report['added'])} added, "
+        f"{len(report['modified'])} modified, {len(report['removed'])} removed, "
+        f"{len(report['failed'])} failed, {report['unchanged']} unchanged files "
+        f"({report['chunks_added']} chunks added, "
+        f"{report['chunks_deleted']} deleted)."
+    )
+    return report
+
+
+def get_index_version():
+    """Modification time of the persisted index, changes when it is rebuilt."""
+    index_file = vector_store_file()
+    if not os.path.exists(index_file):
+        return None
+    return os.path.getmtime(index_file)
+
+
+def _lexical_index_key():
+    """Store the lexical index was built from, changes with the backend and
+    whenever the index is written, also by another process."""
+    return (config.VECTOR_STORE, vector_store_file(), get_index_version())
+
+
+def get_lexical_index(db):
+    """Process-wide BM25 index over the chunks in the vector store.
+
+    Built from the store on first use and kept in sync by
+    update_document_embedding afterwards. Rebuilt when the configured store
+    or its index version changed since.
+    """
+    global _lexical_index, _lexical_key
+    key = _lexical_index_key()
+    with _lexical_lock:
+        if _lexical_index is None or _lexical_key != key:
+            data = db.get(include=["documents", "metadatas"])
+            docs = [
+                Document(page_content=text, metadata=metadata or {})
+                for text, metadata in zip(data["documents"], data["metadatas"])
+            ]
+            index = BM25Index()
+            index.add_documents(data["ids"], docs)
+            _lexical_index, _lexical_key = index, key
+        return _lexical_index
+
+
+def reset_lexical_index():
+    global _lexical_index, _lexical_key
+    with _lexical_lock:
+        _lexical_index, _lexical_key = None, None
+
+
+def _update_lexical_index(deleted_ids=(), added_ids=(), added_docs=()):
+    global _lexical_key
+    with _lexical_lock:
+        if _lexical_index is None:
+            return
+        _lexical_index.delete(deleted_ids)
+        _lexical_index.add_documents(added_ids, added_docs)
+        # Mirrors the store as just written, no rebuild needed
+        _lexical_key = _lexical_index_key()
 
 
 def create_retriver():
-    embeddings = OllamaEmbeddings(**config.EMBEDDING_MODEL_CONFIG)
+    embeddings = get_embeddings()
     print("Embeddings model initialized.")
-    if not os.path.exists(config.EMBEDDING_PATH):
+    if not os.path.exists(vector_store_file()):
         print("Embeddings not found. Creating new embeddings...")
         create_document_embbedding()
+    elif config.INCREMENTAL_INDEXING:
+        update_document_embedding()
 
     # Load Embeddings
-    db = Chroma(embedding_function=embeddings, persist_directory=config.EMBEDDING_PATH)
-    retriever = db.as_retriever(
-        search_type="similarity",
-        search_kwargs={"k": 2},
+    db = create_vector_store(embeddings)
+    retriever_config = config.RETRIEVER_CONFIG
+    if retriever_config["search_type"] != "hybrid":
+        return db.as_retriever(
+            search_type="similarity",
+            search_kwargs={"k": retriever_config["k"]},
+        )
+
+    retriever = HybridRetriever(
+        vector_retriever=db.as_retriever(
+            search_type="similarity",
+            search_kwargs={"k": retriever_config["fetch_k"]},
+        ),
+        lexical_index_provider=lambda: get_lexical_index(db),
+        k=retriever_config["k"],
+        fetch_k=retriever_config["fetch_k"],
+        rrf_k=retriever_config["rrf_k"],
     )
     return retriever
 
 
 if __name__ == "__main__":
-    create_document_embbedding()
+    update_document_embedding()
     retriver = create_retriver()
     retriver.get_relevant_documents("holiday 2025")
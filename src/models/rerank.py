@@ -0,0 +1,68 @@
+from flashrank import Ranker, RerankRequest
+
+from src import config
+
+
+class FlashRankReranker:
+    """Cross-encoder reranker running locally on CPU with FlashRank (ONNX).
+
+    All candidates are scored against the question in a single batch,
+    documents below the score threshold are dropped and at most top_n
+    are kept, ordered by score.
+
+    # Example usage:
+    reranker = FlashRankReranker(**config.RERANKER_CONFIG)
+    docs = reranker.rerank("what is backfill process?", docs)
+    """
+
+    def __init__(
+        self,
+        model_name="ms-marco-MiniLM-L-12-v2",
+        cache_dir="data/models/",
+        max_length=512,
+        score_threshold=0.1,
+        top_n=None,
+    ) -> None:
+        self.ranker = Ranker(
+            model_name=model_name, cache_dir=cache_dir, max_length=max_length
+        )
+        self.score_threshold = score_threshold
+        self.top_n = top_n
+
+    def rerank(self, question, documents):
+        if not documents:
+            return []
+
+        passages = [
+            {"id": i, "text": doc.page_content} for i, doc in enumerate(documents)
+        ]
+        results = self.ranker.rerank(RerankRequest(query=question, passages=passages))
+
+        ranked_docs = []
+        for result in results:
+            score = float(result["score"])
+            if score < self.score_threshold:
+                continue
+            doc = documents[result["id"]]
+            doc.metadata["relevance_score"] = score
+            ranked_docs.append(doc)
+
+        if self.top_n is not None:
+            ranked_docs = ranked_docs[: self.top_n]
+        return ranked_docs
+
+
+def create_reranker(grader_type=None):
+    """Build the reranker for config.GRADER_TYPE.
+
+    Returns None for the "llm" and "none" grader types which need no model.
+    """
+    grader_type = grader_type or config.GRADER_TYPE
+    if grader_type not in ("llm", "crossencoder", "none"):
+        raise ValueError(
+            f"Unknown grader type '{grader_type}', use 'llm', 'crossencoder' or 'none'."
+        )
+
+    if grader_type == "crossencoder":
+        return FlashRankReranker(**config.RERANKER_CONFIG)
+    return None
@@ -0,0 +1,157 @@
+import math
+import re
+import threading
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, List
+
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+_TOKEN_PATTERN = re.compile(r"\w+")
+
+# Shared by every hybrid retriever to run lexical and vector search together
+_search_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="hybrid-search")
+
+
+def tokenize(text):
+    return _TOKEN_PATTERN.findall(text.lower())
+
+
+class BM25Index:
+    """In-process inverted index scored with Okapi BM25.
+
+    Documents are added and deleted by chunk id so the index can follow
+    incremental updates of the vector store.
+
+    # Example usage:
+    index = BM25Index()
+    index.add_documents(["id-1"], [Document(page_content="backfill process")])
+    index.search("backfill", k=5)
+    """
+
+    def __init__(self, k1=1.5, b=0.75) -> None:
+        self.k1 = k1
+        self.b = b
+        self._postings = defaultdict(dict)
+        self._doc_lengths = {}
+        self._docs = {}
+        self._total_length = 0
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._docs)
+
+    def add_documents(self, ids, docs):
+        with self._lock:
+            self.delete([doc_id for doc_id in ids if doc_id in self._docs])
+            for doc_id, doc in zip(ids, docs):
+                terms = Counter(tokenize(doc.page_content))
+                for term, frequency in terms.items():
+                    self._postings[term][doc_id] = frequency
+                length = sum(terms.values())
+                self._doc_lengths[doc_id] = length
+                self._total_length += length
+                self._docs[doc_id] = doc
+
+    def delete(self, ids):
+        with self._lock:
+            for doc_id in ids:
+                doc = self._docs.pop(doc_id, None)
+                if doc is None:
+                    continue
+                for term in set(tokenize(doc.page_content)):
+                    postings = self._postings.get(term)
+                    if postings is not None:
+                        postings.pop(doc_id, None)
+                        if not postings:
+                            del self._postings[term]
+                self._total_length -= self._doc_lengths.pop(doc_id)
+
+    def search(self, query, k=4):
+        """Return the top k (doc_id, document, score) for the query."""
+        with self._lock:
+            n_docs = len(self._docs)
+            if not n_docs:
+                return []
+            avg_length = self._total_length / n_docs
+            scores = defaultdict(float)
+            for term in set(tokenize(query)):
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(
+                    1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5)
+                )
+                for doc_id, frequency in postings.items():
+                    norm = self.k1 * (
+                        1 - self.b + self.b * self._doc_lengths[doc_id] / avg_length
+                    )
+                    scores[doc_id] += (
+                        idf * frequency * (self.k1 + 1) / (frequency + norm)
+                    )
+
+            top = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+            return [(doc_id, self._docs[doc_id], score) for doc_id, score in top]
+
+
+def _doc_key(doc):
+    return doc.id or doc.page_content
+
+
+def reciprocal_rank_fusion(result_lists, k=60):
+    """Fuse ranked document lists, score is the sum of 1 / (k + rank)."""
+    scores, docs = defaultdict(float), {}
+    for results in result_lists:
+        for rank, doc in enumerate(results):
+            key = _doc_key(doc)
+            scores[key] += 1.0 / (k + rank + 1)
+            docs.setdefault(key, doc)
+    ranked = sorted(scores, key=scores.get, reverse=True)
+    return [docs[key] for key in ranked]
+
+
+class HybridRetriever(BaseRetriever):
+    """Runs BM25 and vector search concurrently and fuses them with RRF.
+
+    Exact terms like product names, policy codes or "backfill" are found by
+    the lexical index even when the embedding misses them. The index comes
+    from lexical_index_provider on every query, so a long-lived retriever
+    sees it rebuilt after the store changed.
+
+    # Example usage:
+    retriever = HybridRetriever(
+        vector_retriever=db.as_retriever(search_kwargs={"k": 8}),
+        lexical_index_provider=lambda: get_lexical_index(db),
+    )
+    """
+
+    vector_retriever: BaseRetriever
+    lexical_index_provider: Callable[[], Any]
+    k: int = 2
+    fetch_k: int = 8
+    rrf_k: int = 60
+
+    def _lexical_search(self, query):
+        results = []
+        lexical_index = self.lexical_index_provider()
+        for doc_id, doc, _ in lexical_index.search(query, k=self.fetch_k):
+            results.append(
+                Document(
+                    id=doc_id,
+                    page_content=doc.page_content,
+                    metadata=dict(doc.metadata),
+                )
+            )
+        return results
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        lexical = _search_pool.submit(self._lexical_search, query)
+        vector_docs = self.vector_retriever.invoke(
+            query, config={"callbacks": run_manager.get_child()}
+        )
+        fused = reciprocal_rank_fusion([vector_docs, lexical.result()], k=self.rrf_k)
+        return fused[: self.k]
@@ -0,0 +1,104 @@
+import numpy as np
+
+# Labeled example questions for each branch of the graph
+ROUTE_EXAMPLES = {
+    "rag": [
+        "what is backfill process?",
+        "what are the steps to do backfill?",
+        "how do I protect items in my department?",
+        "how to handle difficult customer?",
+        "what is the overtime and weekend work policy and pay here?",
+        "how many days of annual leave do I get?",
+        "how do I apply for sick leave?",
+        "how to fold a shirt for display?",
+        "how do I apply a spider wrap to a product?",
+        "what is the parental leave policy?",
+        "how to secure high value items?",
+        "what should I do when a customer wants a refund?",
+    ],
+    "db": [
+        "where is the denim jeans located in store S001?",
+        "which aisle has the leather jacket?",
+        "what is the location of product P004?",
+        "how many employees are working in stocking today?",
+        "how many cashiers were rostered at the New York Flagship on 2025-01-21?",
+        "which stores were understaffed last week?",
+        "what is the minimum required staff for cashier at S002?",
+        "list all products in the Los Angeles West store",
+        "when was the product location last updated?",
+        "show the actual employees per operation for each store",
+    ],
+}
+
+
+def _normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+class EmbeddingRouter:
+    """Routes a question with one embedding lookup instead of an LLM call.
+
+    The question is compared with the centroid of each label's example
+    questions and with its k nearest examples. When both agree and the
+    centroid margin is above min_confidence the label is returned, otherwise
+    the fallback (e.g. the LLM router) decides.
+
+    # Example usage:
+    router = EmbeddingRouter(get_embeddings(), fallback=llm_route)
+    label, confidence = router.route("where is the denim jeans located?")
+    """
+
+    def __init__(
+        self, embeddings, examples=None, k=5, min_confidence=0.03, fallback=None
+    ) -> None:
+        examples = examples or ROUTE_EXAMPLES
+        self.embeddings = embeddings
+        self.k = k
+        self.min_confidence = min_confidence
+        self.fallback = fallback
+
+        self.labels = list(examples)
+        texts = [text for label in self.labels for text in examples[label]]
+        self._example_labels = np.array(
+            [i for i, label in enumerate(self.labels) for _ in examples[label]]
+        )
+        self._examples = _normalize(
+            np.asarray(embeddings.embed_documents(texts), dtype=np.float32)
+        )
+        self._centroids = _normalize(
+            np.stack(
+                [
+                    self._examples[self._example_labels == i].mean(axis=0)
+                    for i in range(len(self.labels))
+                ]
+            )
+        )
+
+    def _classify(self, question):
+        vector = _normalize(
+            np.asarray(self.embeddings.embed_query(question), dtype=np.float32)
+        )
+        centroid_scores = self._centroids @ vector
+        order = np.argsort(centroid_scores)[::-1]
+        best = int(order[0])
+        margin = float(centroid_scores[best] - centroid_scores[order[1]])
+
+        similarities = self._examples @ vector
+        nearest = np.argsort(similarities)[::-1][: self.k]
+        votes = np.bincount(
+            self._example_labels[nearest],
+            weights=similarities[nearest],
+            minlength=len(self.labels),
+        )
+        if int(np.argmax(votes)) != best:
+            margin = 0.0
+        return self.labels[best], margin
+
+    def route(self, question):
+        """Return (label, confidence), confidence is 0.0 when the fallback decided."""
+        label, confidence = self._classify(question)
+        if confidence < self.min_confidence and self.fallback is not None:
+            return self.fallback(question), 0.0
+        return label, confidence
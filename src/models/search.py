@@ -1,9 +1,97 @@
-from langchain_ollama import OllamaEmbeddings
+import bisect
+import csv
+import difflib
+import threading
+from collections import defaultdict
+from typing import Optional
+
 from langchain.tools import BaseTool
-from langchain_chroma import Chroma
+from pydantic import PrivateAttr
 
 
 from src import config
+from src.data.embeddings import get_embeddings
+from src.data.vector_store import create_vector_store
+
+
+class ProductIndex:
+    """In-memory exact, prefix and fuzzy index of product locations.
+
+    Rows are indexed by product_id and product_name per store_id (and
+    across all stores), so most lookups are answered without embedding.
+
+    # Example usage:
+    index = ProductIndex.from_csv("data/raw/dummy_product_location.csv")
+    index.lookup("denim jeans", store_id="S001")
+    """
+
+    def __init__(self, rows) -> None:
+        self._by_id = defaultdict(lambda: defaultdict(list))
+        self._by_name = defaultdict(lambda: defaultdict(list))
+        for row in rows:
+            for store in (row["store_id"], None):
+                self._by_id[store][row["product_id"].lower()].append(row)
+                self._by_name[store][row["product_name"].lower()].append(row)
+        self._names = {store: sorted(names) for store, names in self._by_name.items()}
+
+    @classmethod
+    def from_csv(cls, csv_file):
+        with open(csv_file, newline="") as f:
+            return cls(list(csv.DictReader(f)))
+
+    def lookup(self, query, store_id=None, fuzzy_cutoff=0.8):
+        """Return matching rows, trying exact id, exact name, name prefix and
+        then fuzzy name matches. Empty list when nothing matches."""
+        key = query.strip().lower()
+        if not key:
+            return []
+        by_id, by_name = self._by_id.get(store_id), self._by_name.get(store_id)
+        if by_id is None:
+            return []
+
+        if key in by_id:
+            return list(by_id[key])
+        if key in by_name:
+            return list(by_name[key])
+
+        names = self._names[store_id]
+        start = bisect.bisect_left(names, key)
+        prefixed = []
+        for name in names[start:]:
+            if not name.startswith(key):
+                break
+            prefixed.extend(by_name[name])
+        if prefixed:
+            return prefixed
+
+        matches = difflib.get_close_matches(key, names, n=3, cutoff=fuzzy_cutoff)
+        return [row for name in matches for row in by_name[name]]
+
+
+_product_index = None
+_retriever = None
+_shared_lock = threading.Lock()
+
+
+def get_product_index():
+    global _product_index
+    with _shared_lock:
+        if _product_index is None:
+            _product_index = ProductIndex.from_csv(config.PRODUCT_LOCATION_PATH)
+        return _product_index
+
+
+def get_product_retriever():
+    """Long-lived vector retriever shared by every ProductSearch call."""
+    global _retriever
+    with _shared_lock:
+        if _retriever is None:
+            db = create_vector_store(get_embeddings())
+            _retriever = db.as_retriever(
+                search_type="similarity",
+                search_kwargs={"k": 3},
+            )
+        return _retriever
 
 
 class ProductSearch(BaseTool):
@@ -12,32 +100,27 @@ class ProductSearch(BaseTool):
         "Tool to search kmart products similar to the query. Returns Name and img."
     )
 
-    def search(self, query: str) -> str:
-        embeddings = OllamaEmbeddings(model="mxbai-embed-large")
-        print("Embeddings model initialized.")
-
-        # Load Embeddings
-        db = Chroma(
-            embedding_function=embeddings, persist_directory=config.EMBEDDING_PATH
-        )
-        retriever = db.as_retriever(
-            search_type="similarity",
-            search_kwargs={"k": 2},
-        )
-        docs = retriever.invoke(query)
-        return [doc.metadata for doc in docs]
-
-    def _run(self, query: str) -> str:
-        embeddings = OllamaEmbeddings(model="nomic-embed-text")
-        print("Embeddings model initialized.")
-
-        # Load Embeddings
-        db = Chroma(
-            embedding_function=embeddings, persist_directory=config.EMBEDDING_PATH
-        )
-        retriever = db.as_retriever(
-            search_type="similarity",
-            search_kwargs={"k": 3},
-        )
-        docs = retriever.invoke(query)
-        return str([doc.metadata for doc in docs])
+    _index: ProductIndex = PrivateAttr(default=None)
+    _retriever: object = PrivateAttr(default=None)
+
+    def _lookup(self, query, store_id=None):
+        if self._index is None:
+            self._index = get_product_index()
+        rows = self._index.lookup(query, store_id=store_id)
+        if rows:
+            return rows
+
+        # Fall back to vector search only when the index has no match
+        if self._retriever is None:
+            self._retriever = get_product_retriever()
+        docs = self._retriever.invoke(query)
+        results = [doc.metadata for doc in docs]
+        if store_id is not None:
+            results = [r for r in results if r.get("store_id") in (None, store_id)]
+        return results
+
+    def search(self, query: str, store_id: Optional[str] = None) -> str:
+        return self._lookup(query, store_id)
+
+    def _run(self, query: str, store_id: Optional[str] = None) -> str:
+        return str(self._lookup(query, store_id))
@@ -0,0 +1,157 @@
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+def _normalize_question(question):
+    return " ".join(question.lower().split())
+
+
+class SemanticCache:
+    """Answer cache keyed by the embedding of the question.
+
+    A question is a hit when a previously answered question has a cosine
+    similarity above the threshold. Entries expire after ttl seconds, the
+    least recently used entry is evicted once max_size is reached and the
+    whole cache is dropped when index_version() changes (index rebuilt).
+
+    # Example usage:
+    cache = SemanticCache(embeddings, threshold=0.92)
+    entry, vector = cache.lookup("what is backfill process?")
+    if entry is None:
+        response = agent.invoke({"question": question})
+        cache.update(question, vector, response)
+    """
+
+    def __init__(
+        self,
+        embeddings,
+        threshold=0.92,
+        ttl=24 * 60 * 60,
+        max_size=1000,
+        index_version=None,
+    ) -> None:
+        self.embeddings = embeddings
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_size = max_size
+        self.index_version = index_version
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._matrix = None
+        self._keys = []
+        self._version = index_version() if index_version else None
+
+        self.hits = 0
+        self.misses = 0
+        self.lookup_seconds = 0.0
+
+    def lookup(self, question):
+        """Return (entry, question_vector), entry is None on a miss.
+
+        The vector is returned so update() does not embed the question again.
+        """
+        start = time.perf_counter()
+        key = _normalize_question(question)
+        with self._lock:
+            self._check_index_version()
+            self._expire()
+            entry = self._entries.get(key)
+        vector = None
+
+        if entry is None:
+            vector = self._embed(question)
+            with self._lock:
+                entry = self._nearest(vector)
+
+        with self._lock:
+            if entry is not None:
+                if entry["key"] in self._entries:
+                    self._entries.move_to_end(entry["key"])
+                self.hits += 1
+            else:
+                self.misses += 1
+            self.lookup_seconds += time.perf_counter() - start
+        return entry, vector
+
+    def update(self, question, vector, response):
+        """Store the generation and source documents of an answered question."""
+        if vector is None:
+            vector = self._embed(question)
+        key = _normalize_question(question)
+        entry = {
+            "key": key,
+            "question": question,
+            "vector": vector,
+            "generation": response["generation"],
+            "documents": response.get("documents", []),
+            "created": time.time(),
+        }
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+            self._matrix = None
+
+    def invalidate(self):
+        """Drop every entry, call this when the document index is rebuilt."""
+        with self._lock:
+            self._clear()
+
+    def metrics(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "avg_lookup_ms": (
+                    1000 * self.lookup_seconds / lookups if lookups else 0.0
+                ),
+            }
+
+    def _embed(self, question):
+        vector = np.asarray(self.embeddings.embed_query(question), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _nearest(self, vector):
+        if not self._entries:
+            return None
+        if self._matrix is None:
+            self._keys = list(self._entries)
+            self._matrix = np.stack([self._entries[k]["vector"] for k in self._keys])
+
+        scores = self._matrix @ vector
+        best = int(np.argmax(scores))
+        if scores[best] < self.threshold:
+            return None
+        return self._entries[self._keys[best]]
+
+    def _expire(self):
+        if self.ttl is None:
+            return
+        cutoff = time.time() - self.ttl
+        expired = [k for k, e in self._entries.items() if e["created"] < cutoff]
+        for key in expired:
+            del self._entries[key]
+        if expired:
+            self._matrix = None
+
+    def _check_index_version(self):
+        if self.index_version is None:
+            return
+        version = self.index_version()
+        if version != self._version:
+            self._clear()
+            self._version = version
+
+    def _clear(self):
+        self._entries.clear()
+        self._matrix = None
+        self._keys = []
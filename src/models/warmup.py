@@ -0,0 +1,80 @@
+import threading
+import time
+
+from langchain_community.chat_models import ChatOllama
+
+from src import config
+from src.models.prompt import PROMPT_BUILDERS
+
+
+def uncached(llm):
+    """Copy of llm that skips the global LLM cache, so calls reach the model."""
+    return llm.model_copy(update={"cache": False})
+
+
+def prefix_messages(prompt):
+    """Messages of a prompt with empty variables, i.e. its static prefix."""
+    return prompt.format_messages(**{name: "" for name in prompt.input_variables})
+
+
+def prompt_eval(message):
+    """Prefill stats Ollama reports in the response metadata of a message."""
+    info = message.response_metadata or {}
+    return {
+        "load_ms": (info.get("load_duration") or 0) / 1e6,
+        "prompt_eval_ms": (info.get("prompt_eval_duration") or 0) / 1e6,
+        "prompt_tokens": info.get("prompt_eval_count") or 0,
+    }
+
+
+def warmup(llm=None, prompts=None, num_predict=None):
+    """Load the chat model and prime Ollama's KV cache with prompt prefixes.
+
+    Sends the static prefix of each prompt in prompts (PROMPT_BUILDERS
+    names) generating num_predict tokens, so the first real request neither
+    waits for the model to load nor evaluates the system prompt again.
+    Ollama keeps one cached prompt per parallel slot, so the prompt that
+    should stay cached the longest goes last.
+
+    # Example usage:
+    stats = warmup(ChatOllama(**config.MODEL_CONFIG), prompts=["rerank", "ragqa"])
+    """
+    warmup_config = config.WARMUP_CONFIG
+    llm = uncached(llm or ChatOllama(**config.MODEL_CONFIG))
+    primer = llm.bind(num_predict=num_predict or warmup_config["num_predict"])
+
+    stats = []
+    for name in prompts or warmup_config["prompts"]:
+        start = time.perf_counter()
+        try:
+            message = primer.invoke(prefix_messages(PROMPT_BUILDERS[name]()))
+        except Exception as e:
+            # The model server is most likely down, the next prompts would fail too
+            print(f"Warmup of the {name} prompt failed: {e}")
+            break
+        stats.append(
+            {
+                "prompt": name,
+                "total_ms": 1000 * (time.perf_counter() - start),
+                **prompt_eval(message),
+            }
+        )
+    if stats:
+        print(
+            f"Warmed up {len(stats)} prompts in "
+            f"{sum(row['total_ms'] for row in stats):.0f}ms "
+            f"(model load {sum(row['load_ms'] for row in stats):.0f}ms)."
+        )
+    return stats
+
+
+def start_warmup(llm=None):
+    """Run warmup in a daemon thread so start-up does not wait for it."""
+    thread = threading.Thread(target=warmup, args=(llm,), name="warmup", daemon=True)
+    thread.start()
+    return thread
+
+
+if __name__ == "__main__":
+    for row in warmup():
+        print(row)
@@ -6,9 +6,28 @@ import requests
 from io import BytesIO
 
 import json
+import uuid
 
 
-from src.models.chat import generate_response
+from src.models.chat import stream_response
+
+
+def _step_label(node, update):
+    """Status label shown once a graph node has finished."""
+    documents = update.get("documents") or []
+    if node == "contextualize":
+        return "Retrieving documents..."
+    if node == "retrieve":
+        return f"Grading {len(documents)} retrieved documents..."
+    if node == "grade_docs":
+        return f"Generating answer from {len(documents)} documents..."
+    if node == "cache":
+        return "Answered from a similar question"
+    if node == "sql_qa":
+        return "Answered from store data"
+    if node == "evaluate":
+        return "Answer checked"
+    return "Generating answer..."
 
 
 def generate_page():
@@ -19,6 +38,9 @@ def generate_page():
 
     if "messages" not in st.session_state:
         st.session_state.messages = []
+    if "thread_id" not in st.session_state:
+        # Keys this session's conversation memory in the agent
+        st.session_state.thread_id = str(uuid.uuid4())
 
     with st.chat_message("Assistant"):
         st.markdown("Hello, How can I help you today?")
@@ -31,10 +53,28 @@ def generate_page():
         st.chat_message("user").markdown(prompt)
         st.session_state.messages.append({"role": "user", "content": prompt})
 
-        response = generate_response(input=prompt)
-
         with st.chat_message("assistant"):
-            st.markdown(response["generation"])
+            status = st.status("Retrieving documents...")
+            response = {}
+
+            def tokens():
+                for event, value, update in stream_response(
+                    input=prompt, thread_id=st.session_state.thread_id
+                ):
+                    if event == "token":
+                        yield value
+                    elif event == "status":
+                        status.update(label=_step_label(value, update))
+                    else:
+                        response.update(value)
+
+            streamed = st.write_stream(tokens())
+            status.update(label="Done", state="complete")
+
+            # The evaluate node can replace the streamed answer
+            if response.get("generation", streamed) != streamed:
+                st.markdown(response["generation"])
+            response.setdefault("generation", streamed)
 
         st.session_state.messages.append(
             {"role": "assistant", "content": response["generation"]}